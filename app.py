@@ -9,419 +9,102 @@ explicit encoding fixes for Windows environments.
 Date: 2025-12-08
 """
 
-import base64
+import asyncio
+import binascii
+import hashlib
+import itertools
 import json
+import mmap
 import os
-import time
+import re
+import shutil
 import subprocess
-from dataclasses import dataclass
-from io import BytesIO
-from typing import List, Tuple, Any, Optional, Callable
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from functools import cache, lru_cache, partial
+from io import BytesIO, StringIO
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Tuple, Any, Optional, Callable
 
 import gradio as gr
+import httpx
 from dotenv import load_dotenv
-from openai import OpenAI, APIConnectionError, APITimeoutError
+from openai import (
+    AsyncOpenAI,
+    APIConnectionError,
+    APITimeoutError,
+    InternalServerError,
+    RateLimitError,
+)
 from PIL import Image
-from pypdf import PdfReader
-import typhoon_ocr.ocr_utils
-from typhoon_ocr import prepare_ocr_messages
-
-# --- CONSTANTS & CONFIGURATION ---
-
-APP_TITLE = "Typhoon OCR"
-APP_SUBTITLE = "ระบบแปลงเอกสารเป็นดิจิทัลระดับมืออาชีพ"
-
-# Premium Dark Theme CSS (Ultra-Refined)
-APP_CSS = """
-@import url('https://fonts.googleapis.com/css2?family=Kanit:wght@300;400;500;600;700&family=Outfit:wght@300;400;500;600;700&display=swap');
-
-:root {
-    --primary-color: #8b5cf6;
-    --primary-glow: rgba(139, 92, 246, 0.4);
-    --secondary-color: #6366f1;
-    --bg-dark: #09090b;
-    --card-glass: rgba(30, 30, 46, 0.7);
-    --border-glass: rgba(255, 255, 255, 0.08);
-    --text-main: #e4e4e7;
-    --text-muted: #a1a1aa;
-}
-
-body {
-    font-family: 'Kanit', 'Outfit', sans-serif !important;
-    background-color: var(--bg-dark) !important;
-    margin: 0;
-    padding: 0;
-    /* Deep Radial Gradient Background */
-    background-image: 
-        radial-gradient(circle at 15% 50%, rgba(139, 92, 246, 0.08), transparent 25%), 
-        radial-gradient(circle at 85% 30%, rgba(99, 102, 241, 0.08), transparent 25%);
-    background-attachment: fixed;
-}
-
-.gradio-container {
-    background-color: transparent !important; /* Let body bg shine through */
-    max-width: 1400px !important;
-}
-
-/* Header */
-.header-container {
-    display: flex;
-    align-items: center;
-    justify-content: space-between;
-    margin-bottom: 40px;
-    padding: 20px 0;
-    border-bottom: 1px solid var(--border-glass);
-}
-.logo-text {
-    font-size: 36px;
-    font-weight: 700;
-    font-family: 'Outfit', sans-serif;
-    background: linear-gradient(to right, #fff, #a78bfa);
-    -webkit-background-clip: text;
-    -webkit-text-fill-color: transparent;
-    letter-spacing: -0.03em;
-}
+from starlette.middleware import Middleware
+from typhoon_ocr.ocr_utils import _pdf_reader, _pdf_reader_lock, prepare_ocr_messages_with_image
+from typhoon_ocr.retry_utils import backoff_delay, retry_after_seconds
 
-/* Glassmorphism Cards */
-.glass-card {
-    background: var(--card-glass) !important;
-    backdrop-filter: blur(16px) !important;
-    -webkit-backdrop-filter: blur(16px) !important;
-    border: 1px solid var(--border-glass) !important;
-    border-radius: 20px !important;
-    padding: 32px !important;
-    box-shadow: 0 8px 32px 0 rgba(0, 0, 0, 0.2) !important;
-    transition: all 0.3s ease;
-}
-.glass-card:hover {
-    border-color: rgba(139, 92, 246, 0.2) !important;
-    box-shadow: 0 12px 40px -10px rgba(139, 92, 246, 0.15) !important;
-    transform: translateY(-2px);
-}
-
-/* Section Titles */
-.section-icon {
-    display: inline-flex;
-    align-items: center;
-    justify-content: center;
-    width: 32px;
-    height: 32px;
-    border-radius: 8px;
-    background: rgba(139, 92, 246, 0.1);
-    color: #a78bfa;
-    margin-right: 12px;
-}
-.section-title h3 {
-    display: flex;
-    align-items: center;
-    color: var(--text-main);
-    font-weight: 600 !important;
-    font-size: 1.1rem !important;
-    margin-bottom: 24px !important;
-    font-family: 'Kanit', sans-serif !important;
-}
+# Optional faster JSON decoder
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
-/* Custom Inputs to sink them in */
-.gr-input, .gr-box, input, textarea, select {
-    background-color: rgba(0, 0, 0, 0.3) !important;
-    border: 1px solid var(--border-glass) !important;
-    border-radius: 12px !important;
-    color: var(--text-main) !important;
-    font-family: 'Kanit', sans-serif !important;
-    transition: border-color 0.2s;
-}
-.gr-input:focus-within {
-    border-color: var(--primary-color) !important;
-    box-shadow: 0 0 0 2px rgba(139, 92, 246, 0.2) !important;
-}
+# Optional PDFium bindings for fast page counting
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
 
-/* Status Bar (Integrated) */
-.status-bar {
-    display: flex;
-    align-items: center;
-    gap: 12px;
-    padding: 12px 16px;
-    background: rgba(139, 92, 246, 0.05);
-    border: 1px solid rgba(139, 92, 246, 0.1);
-    border-radius: 12px;
-    margin-top: 16px;
-    font-size: 0.9rem;
-    color: #d4d4d8;
-    font-family: 'Kanit', sans-serif;
-}
-.status-dot {
-    width: 8px;
-    height: 8px;
-    border-radius: 50%;
-    background-color: #52525b; /* Default gray */
-    box-shadow: 0 0 8px rgba(82, 82, 91, 0.5);
-}
-.status-active .status-dot {
-    background-color: #4ade80;
-    box-shadow: 0 0 8px #4ade80;
-}
+# Optional SIMD base64 codec (page renders are decoded/encoded per page)
+try:
+    import pybase64
+    _b64decode = pybase64.b64decode
+    _b64encode = pybase64.b64encode
+except ImportError:
+    # binascii is the C codec behind base64.b64decode/b64encode, minus their wrapper overhead
+    _b64decode = binascii.a2b_base64
+    _b64encode = partial(binascii.b2a_base64, newline=False)
 
-/* Radio Buttons & Checkboxes Fix (Aggressive) */
-fieldset {
-    background-color: transparent !important;
-    border: 1px solid var(--border-glass) !important;
-}
-fieldset span {
-    color: var(--text-main) !important;
-    font-weight: 500;
-    font-family: 'Kanit', sans-serif !important;
-}
-label {
-    background-color: rgba(255, 255, 255, 0.05) !important;
-    border-color: var(--border-glass) !important;
-    color: var(--text-main) !important;
-    transition: all 0.2s;
-}
-label:hover {
-    background-color: rgba(139, 92, 246, 0.2) !important;
-}
-label.selected {
-    background-color: var(--primary-color) !important;
-    border-color: var(--primary-color) !important;
-    color: white !important;
-}
-/* Hide default radio circle if custom styling is applied to label */
-input[type="radio"] {
-    accent-color: var(--primary-color) !important;
-}
+# --- CONSTANTS & CONFIGURATION ---
 
-/* Primary Button */
-.primary-btn {
-    background: linear-gradient(135deg, #7c3aed 0%, #4f46e5 100%) !important;
-    border: none !important;
-    color: white !important;
-    font-weight: 600 !important;
-    font-size: 1.1rem !important;
-    border-radius: 14px !important;
-    padding: 16px 24px !important;
-    box-shadow: 0 4px 15px rgba(124, 58, 237, 0.3) !important;
-    transition: all 0.2s !important;
-    margin-top: 24px !important;
-    font-family: 'Kanit', sans-serif !important;
-}
-.primary-btn:hover {
-    transform: translateY(-1px);
-    box-shadow: 0 6px 20px rgba(124, 58, 237, 0.4) !important;
-    opacity: 0.95;
-}
+APP_TITLE = "Typhoon OCR"
+APP_SUBTITLE = "ระบบแปลงเอกสารเป็นดิจิทัลระดับมืออาชีพ"
 
-/* Results Area */
-.output-container {
-    background-color: rgba(0, 0, 0, 0.3) !important;
-    border-radius: 16px !important;
-    border: 1px solid var(--border-glass) !important;
-    overflow: hidden;
-}
-.output-header-bar {
-    padding: 12px 20px;
-    background: rgba(255, 255, 255, 0.03);
-    border-bottom: 1px solid var(--border-glass);
-    display: flex;
-    justify-content: space-between;
-    align-items: center;
-}
-.copy-btn-styled {
-    display: flex;
-    align-items: center;
-    gap: 6px;
-    padding: 6px 12px;
-    border-radius: 8px;
-    background: rgba(255,255,255,0.05);
-    color: #a78bfa;
-    border: 1px solid transparent;
-    cursor: pointer;
-    font-size: 0.85rem;
-    font-weight: 500;
-    transition: all 0.2s;
-    font-family: 'Kanit', sans-serif;
-}
-.copy-btn-styled:hover {
-    background: rgba(139, 92, 246, 0.15);
-    border-color: rgba(139, 92, 246, 0.3);
-    color: #fff;
-}
-.gr-textarea textarea {
-    font-family: 'JetBrains Mono', 'Courier New', monospace !important;
-    font-size: 0.95rem !important;
-    line-height: 1.6 !important;
-    color: #e4e4e7 !important;
-}
+# Premium Dark Theme CSS (Ultra-Refined), served as a cacheable static file
+STATIC_DIR = Path(__file__).resolve().parent / "static"
+APP_CSS_PATH = STATIC_DIR / "app.css"
+APP_COPY_JS_PATH = STATIC_DIR / "copy.js"
+# Page previews handed to the gallery as files; cleared at startup and kept to PREVIEW_CACHE_SIZE files
+PREVIEW_DIR = Path(tempfile.gettempdir()) / "typhoon_ocr_previews"
 
-/* Utilities */
-.sr-only {
-    position: absolute;
-    width: 1px;
-    height: 1px;
-    padding: 0;
-    overflow: hidden;
-    clip: rect(0, 0, 0, 0);
-    border: 0;
-}
-#toast-container {
-    position: fixed;
-    bottom: 32px;
-    right: 32px;
-    z-index: 9999;
-}
 
-/* Dropdown Menu Fix */
-.gr-dropdown, .dropdown-trigger {
-    border-radius: 12px !important;
-    background-color: rgba(0, 0, 0, 0.3) !important;
-    border: 1px solid var(--border-glass) !important;
-}
-.options, .gr-dropdown-options {
-    background: rgba(30, 30, 46, 0.95) !important;
-    backdrop-filter: blur(16px) !important;
-    border: 1px solid var(--border-glass) !important;
-    border-radius: 12px !important;
-    margin-top: 8px !important;
-    box-shadow: 0 10px 25px rgba(0,0,0,0.3) !important;
-    padding: 8px !important;
-}
-.options .item, .gr-dropdown-options .item {
-    color: var(--text-main) !important;
-    padding: 10px 16px !important;
-    font-size: 0.95rem !important;
-    border-radius: 8px !important;
-    margin-bottom: 2px !important;
-    cursor: pointer !important;
-    font-family: 'Kanit', sans-serif !important;
-}
-.options .item:hover, .options .item.selected, .gr-dropdown-options .item:hover {
-    background: rgba(139, 92, 246, 0.2) !important;
-    color: white !important;
-}
-.wrap-inner {
-    background-color: transparent !important;
-    border: none !important;
-}
-/* Fix arrow icon */
-.gr-dropdown svg {
-    fill: #a1a1aa !important;
-}
+def _static_url(path: Path) -> str:
+    """Gradio file URL for a static asset, versioned by content so it can be cached forever."""
+    version = hashlib.md5(path.read_bytes()).hexdigest()[:12]
+    return f"gradio_api/file={path.as_posix()}?v={version}"
 
-/* Tab Labels */
-.tab-nav button {
-    font-family: 'Kanit', sans-serif !important;
-    font-weight: 500;
-}
-"""
 
-APP_JS = """
-(text) => {
-    if (!text) return;
-    
-    const showToast = (message) => {
-        let container = document.getElementById('toast-container');
-        if (!container) {
-            container = document.createElement('div');
-            container.id = 'toast-container';
-            document.body.appendChild(container);
-        }
-        
-        const toast = document.createElement('div');
-        toast.textContent = message;
-        toast.style.background = 'rgba(16, 185, 129, 0.9)';
-        toast.style.backdropFilter = 'blur(8px)';
-        toast.style.color = '#fff';
-        toast.style.padding = '14px 24px';
-        toast.style.marginTop = '10px';
-        toast.style.borderRadius = '12px';
-        toast.style.boxShadow = '0 10px 15px -3px rgba(0, 0, 0, 0.3)';
-        toast.style.fontWeight = '500';
-        toast.style.fontSize = '0.95rem';
-        toast.style.display = 'flex';
-        toast.style.alignItems = 'center';
-        toast.style.gap = '8px';
-        toast.style.fontFamily = "'Kanit', sans-serif";
-        toast.style.animation = 'slideIn 0.3s cubic-bezier(0.16, 1, 0.3, 1)';
-        
-        container.appendChild(toast);
-        
-        setTimeout(() => {
-            toast.style.opacity = '0';
-            toast.style.transform = 'translateY(10px)';
-            toast.style.transition = 'all 0.5s ease';
-            setTimeout(() => toast.remove(), 500);
-        }, 3000);
-    }
-    
-    // Inject Styles for Toast Animation
-    const style = document.createElement('style');
-    style.innerHTML = `
-        @keyframes slideIn {
-            from { opacity: 0; transform: translateY(20px); }
-            to { opacity: 1; transform: translateY(0); }
-        }
-    `;
-    document.head.appendChild(style);
-
-    // Copy to Clipboard with Fallback
-    navigator.clipboard.writeText(text).then(() => {
-        showToast("✨ คัดลอกข้อความสำเร็จ!");
-    }).catch(err => {
-        const ta = document.createElement('textarea');
-        ta.value = text;
-        document.body.appendChild(ta);
-        ta.select();
-        try {
-            document.execCommand('copy');
-            showToast("✨ คัดลอกข้อความสำเร็จ!");
-        } catch (e) {
-            alert("Failed to copy");
-        }
-        document.body.removeChild(ta);
-    });
-}
+# Preconnect to the font hosts and link fonts/CSS directly instead of a render-blocking @import chain
+APP_HEAD = f"""
+<link rel="preconnect" href="https://fonts.googleapis.com">
+<link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
+<link rel="stylesheet" href="https://fonts.googleapis.com/css2?family=Kanit:wght@300;400;500;600;700&family=Outfit:wght@300;400;500;600;700&display=swap">
+<link rel="stylesheet" href="{_static_url(APP_CSS_PATH)}">
+<script src="{_static_url(APP_COPY_JS_PATH)}" defer></script>
 """
 
-# --- SYSTEM PATCHES ---
-
-def _apply_patches() -> None:
-    """
-    Applies a monkey patch to `typhoon_ocr.ocr_utils` to fix Windows encoding issues.
-    Overrides `get_pdf_media_box_width_height` to use UTF-8 explicitly.
-    """
-    def patched_get_pdf_media_box_width_height(local_pdf_path: str, page_num: int) -> tuple[float, float]:
-        command = [
-            "pdfinfo", "-f", str(page_num), "-l", str(page_num), "-box",
-            "-enc", "UTF-8", local_pdf_path
-        ]
-        result = subprocess.run(
-            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-            text=True, encoding='utf-8', errors='replace'
-        )
-        
-        if result.returncode != 0:
-            raise ValueError(f"Error running pdfinfo: {result.stderr}")
-            
-        for line in result.stdout.splitlines():
-            if "MediaBox" in line:
-                try:
-                    parts = line.split(":")[1].split()
-                    return (
-                        abs(float(parts[0]) - float(parts[2])),
-                        abs(float(parts[3]) - float(parts[1]))
-                    )
-                except (IndexError, ValueError):
-                    continue
-        raise ValueError("MediaBox not found")
-
-    typhoon_ocr.ocr_utils.get_pdf_media_box_width_height = patched_get_pdf_media_box_width_height
+# The copy handler lives in static/copy.js; the event only forwards the text to it
+APP_JS = "(text) => window.typhoonCopy && window.typhoonCopy(text)"
 
 # --- STARTUP & CONFIGURATION ---
 
 load_dotenv()
 
-# Apply patches immediately on module load
-_apply_patches()
-
+@cache
 def _check_system_requirements() -> None:
     """
     Performs startup checks for dependencies and configuration.
@@ -441,9 +124,6 @@ def _check_system_requirements() -> None:
     else:
         print("✅ 'TYPHOON_API_KEY' detected.")
 
-# Run checks
-_check_system_requirements()
-
 # --- CONFIGURATION (ENV) ---
 
 @dataclass
@@ -457,45 +137,675 @@ class Config:
     TEMPERATURE: float = 0.1
     TOP_P: float = 0.6
     MAX_RETRIES: int = 5
+    MAX_RETRY_WAIT: float = 60.0
+    # Upper bound on page requests in flight per document
+    CONCURRENCY: int = int(os.getenv("TYPHOON_CONCURRENCY", "5") or 5)
+    REQUESTS_PER_MINUTE: float = float(os.getenv("TYPHOON_RPM", "0") or 0)
+    TOKENS_PER_MINUTE: float = float(os.getenv("TYPHOON_TPM", "0") or 0)
     IMAGE_DIM: int = 1800
+    # PDF pages without embedded images OCR as accurately from a smaller render
+    IMAGE_DIM_TEXT: int = 1200
+    IMAGE_DIM_MIXED: int = 1800
+    PREVIEW_DIM: int = 900
+    STREAM_INTERVAL: float = 0.25
+    PAGE_CACHE_SIZE: int = 32
+    # Preview files kept in PREVIEW_DIR; the least recently used are deleted beyond this
+    PREVIEW_CACHE_SIZE: int = 256
+    # Pages packed into one request; 1 keeps the model's native single-page prompt
+    PAGES_PER_REQUEST: int = int(os.getenv("TYPHOON_PAGES_PER_REQUEST", "1") or 1)
+    # On-disk OCR result cache, keyed by file content hash, task mode and page
+    CACHE_DIR: Path = Path(os.getenv("TYPHOON_CACHE_DIR") or "~/.typhoon_ocr_cache").expanduser()
+    # Entries older than CACHE_MAX_AGE seconds are dropped, then the least recently used
+    # until the cache fits CACHE_MAX_BYTES; pruning runs at startup and every CACHE_PRUNE_INTERVAL stores
+    CACHE_MAX_AGE: float = 30 * 24 * 3600
+    CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+    CACHE_PRUNE_INTERVAL: int = 64
+    # Rough output budget per page when deciding whether a batch fits in MAX_TOKENS
+    PAGE_TOKEN_ESTIMATE: int = 2048
+    # Rough prompt tokens for one rendered page image, for rate-limit reservations
+    IMAGE_TOKEN_ESTIMATE: int = 2048
     TEXT_LENGTH: int = 8000
 
+# --- DOCUMENT CACHE ---
+# Cache keys include mtime and size so entries invalidate when the file changes.
+
+def _file_key(file_path: str) -> Tuple[str, int, int]:
+    """Returns the (path, mtime_ns, size) cache key for a file."""
+    stat = os.stat(file_path)
+    return file_path, stat.st_mtime_ns, stat.st_size
+
+@lru_cache(maxsize=64)
+def _file_hash(path: str, mtime_ns: int, size: int) -> str:
+    """MD5 of the file contents, once per file version; mmap hashes without a read copy."""
+    if size == 0:
+        return hashlib.md5(b"").hexdigest()
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return hashlib.md5(mapped).hexdigest()
+
+def _result_cache_path(file_hash: str, task_mode: str, page_num: int) -> Path:
+    return Config.CACHE_DIR / file_hash / task_mode / f"{page_num}.json"
+
+def _load_cached_page(file_hash: str, task_mode: str, page_num: int) -> Optional[Tuple[bytes, str]]:
+    """Returns (preview_bytes, markdown) for a previously OCR'd page, or None on a miss."""
+    path = _result_cache_path(file_hash, task_mode, page_num)
+    try:
+        data = _json_loads(path.read_bytes())
+        if data.get("model") != Config.MODEL_NAME:
+            return None
+        result = _b64decode(data["image_b64"]), data["markdown"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    try:
+        # A hit counts as recent use, so pruning drops entries nobody reads first
+        os.utime(path)
+    except OSError:
+        pass
+    return result
+
+def _store_cached_page(file_hash: str, task_mode: str, page_num: int, preview_bytes: bytes, markdown: str) -> None:
+    """Writes a page result atomically (temp file + rename); the cache is best-effort."""
+    path = _result_cache_path(file_hash, task_mode, page_num)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.write_text(json.dumps({
+            "model": Config.MODEL_NAME,
+            "markdown": markdown,
+            "image_b64": _b64encode(preview_bytes).decode("ascii"),
+        }), encoding="utf-8")
+        os.replace(tmp_path, path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+        return
+    if next(_cache_store_count) % Config.CACHE_PRUNE_INTERVAL == 0:
+        _prune_result_cache()
+
+# Stores since startup; every CACHE_PRUNE_INTERVAL-th one prunes the cache
+_cache_store_count = itertools.count(1)
+# One prune at a time; a store arriving mid-prune skips its turn
+_cache_prune_lock = threading.Lock()
+
+def _prune_result_cache() -> None:
+    """
+    Deletes cached results older than `Config.CACHE_MAX_AGE`, then the least recently
+    used (by mtime) until the rest fit in `Config.CACHE_MAX_BYTES`. Best-effort, like the cache.
+    """
+    if not _cache_prune_lock.acquire(blocking=False):
+        return
+    try:
+        cutoff = time.time() - Config.CACHE_MAX_AGE
+        entries: List[Tuple[float, int, Path]] = []
+        for path in Config.CACHE_DIR.glob("*/*/*.json"):
+            try:
+                stat = path.stat()
+                if stat.st_mtime < cutoff:
+                    path.unlink()
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            except OSError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total <= Config.CACHE_MAX_BYTES:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+    finally:
+        _cache_prune_lock.release()
+
+# PDFium is not thread-safe
+_pdfium_lock = threading.Lock()
+
+@lru_cache(maxsize=64)
+def _page_count(path: str, mtime_ns: int, size: int) -> int:
+    """Counts pages once per file version, with PDFium when installed, else pypdf."""
+    if pdfium is not None:
+        # One small-buffered sync handle; PDFium reads only the xref/page tree from it
+        with open(path, "rb", buffering=4096) as f, _pdfium_lock:
+            pdf = pdfium.PdfDocument(f)
+            try:
+                return len(pdf)
+            finally:
+                pdf.close()
+    with _pdf_reader_lock:
+        return len(_pdf_reader(path, mtime_ns, size).pages)
+
+@lru_cache(maxsize=1024)
+def _page_has_images(path: str, mtime_ns: int, size: int, page_num: int) -> bool:
+    """
+    Cheap content check: does the page reference image (or form) XObjects?
+    Only the resource dictionary is inspected; no image data is decoded.
+    """
+    with _pdf_reader_lock:
+        page = _pdf_reader(path, mtime_ns, size).pages[page_num - 1]
+        resources = page.get("/Resources")
+        xobjects = resources.get_object().get("/XObject") if resources is not None else None
+        if xobjects is None:
+            return False
+        # Forms may wrap images; treat them as mixed content rather than recursing
+        return any(
+            xobj.get_object().get("/Subtype") in ("/Image", "/Form")
+            for xobj in xobjects.get_object().values()
+        )
+
+@dataclass(frozen=True)
+class PageAssets:
+    """A page's ready-to-send OCR messages plus a gallery-sized JPEG preview."""
+    messages: List[dict]
+    preview_bytes: bytes
+
+    @property
+    def prompt_text(self) -> str:
+        """The page prompt, including its anchor text."""
+        return self.messages[0]["content"][0]["text"]
+
+def _encode_preview(image_bytes: bytes, preview_dim: int) -> bytes:
+    """Downscales a full render to a small JPEG for the gallery."""
+    img = Image.open(BytesIO(image_bytes))
+    img.draft("RGB", (preview_dim, preview_dim))
+    # reducing_gap=1.0 lets Pillow's C box-filter `reduce` do most of the downscale
+    img.thumbnail((preview_dim, preview_dim), Image.Resampling.BILINEAR, reducing_gap=1.0)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    buffer = BytesIO()
+    img.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+def _render_page_assets(
+    file_path: str, task_mode: str, page_num: int, image_dim: int, text_image_dim: int,
+    text_length: int, preview_dim: int
+) -> PageAssets:
+    """
+    Builds a page's OCR messages with `prepare_ocr_messages_with_image`.
+    CPU-bound; runs in the render process pool, so arguments are passed explicitly.
+    PDF pages without images render at `text_image_dim` instead of `image_dim`.
+    The full-size render is decoded and downscaled here, in the worker, so the
+    event loop only ever decodes the small preview.
+    """
+    try:
+        if _is_pdf(file_path) and not _page_has_images(*_file_key(file_path), page_num):
+            image_dim = min(image_dim, text_image_dim)
+        messages, image_base64 = prepare_ocr_messages_with_image(
+            file_path,
+            task_type=task_mode,
+            target_image_dim=image_dim,
+            target_text_length=text_length,
+            page_num=page_num,
+        )
+        return PageAssets(messages, _encode_preview(_b64decode(image_base64), preview_dim))
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Error processing document: {str(e)}")
+
+def _build_batch_messages(task_mode: str, pages: List[Tuple[int, PageAssets]]) -> List[dict]:
+    """
+    Packs several pages into one user message: each page's prompt followed by its
+    image, then an instruction to answer with one JSON object per page.
+    """
+    content: List[dict] = [{
+        "type": "text",
+        "text": f"The following {len(pages)} images are document pages. "
+                "Process each page independently using the instructions given before its image."
+    }]
+    for page_num, assets in pages:
+        prompt_part, image_part = assets.messages[0]["content"]
+        content.append({"type": "text", "text": f"Page {page_num}:\n{prompt_part['text']}"})
+        content.append(image_part)
+    content.append({
+        "type": "text",
+        "text": "Return only a JSON array with one object per page, in the same order: "
+                '[{"page": <page number>, "natural_text": "<page text>"}, ...]'
+    })
+    return [{"role": "user", "content": content}]
+
+def _estimate_batch_tokens(all_assets: List[PageAssets]) -> int:
+    """
+    Rough output-token estimate for a batch: the page prompt with its anchor text (~3 chars
+    per token for mixed Thai/English) or a fixed per-page floor, whichever is larger.
+    """
+    return sum(max(Config.PAGE_TOKEN_ESTIMATE, len(a.prompt_text) // 3) for a in all_assets)
+
+def _estimate_request_tokens(all_assets: List[PageAssets]) -> int:
+    """
+    Tokens to reserve with the rate limiter for one request: per page the rendered
+    image and the prompt text, plus the expected output.
+    """
+    prompt = sum(Config.IMAGE_TOKEN_ESTIMATE + len(a.prompt_text) // 3 for a in all_assets)
+    return prompt + _estimate_batch_tokens(all_assets)
+
+def _parse_batch_response(content: str, page_nums: List[int]) -> Dict[int, str]:
+    """
+    Maps a batched JSON array response back to page numbers.
+    Raises ValueError if the response does not cover every requested page.
+    """
+    items = _json_loads(content)
+    if not isinstance(items, list) or len(items) != len(page_nums):
+        raise ValueError("Batched response does not match the requested pages")
+    texts: Dict[int, str] = {}
+    for index, item in enumerate(items):
+        page_num = item.get("page", page_nums[index])
+        if page_num not in page_nums:
+            page_num = page_nums[index]
+        texts[page_num] = item.get("natural_text") or ""
+    if len(texts) != len(page_nums):
+        raise ValueError("Batched response does not match the requested pages")
+    return texts
+
+def _save_preview(preview_bytes: bytes) -> str:
+    """
+    Writes an encoded page preview to the temp dir and returns its path.
+    The gallery serves the file as-is, so Gradio does not re-encode a PIL image
+    on every streamed update. Files are content-addressed, so re-runs reuse them.
+    """
+    suffix = ".png" if preview_bytes.startswith(b"\x89PNG") else ".jpg"
+    path = PREVIEW_DIR / f"{hashlib.md5(preview_bytes).hexdigest()}{suffix}"
+    if path.exists():
+        # A reused preview counts as recently used, so pruning drops older ones first
+        os.utime(path)
+    else:
+        PREVIEW_DIR.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(preview_bytes)
+        _prune_previews()
+    return str(path)
+
+def _prune_previews() -> None:
+    """Deletes the least recently used previews beyond `Config.PREVIEW_CACHE_SIZE` (by mtime)."""
+    entries = []
+    with os.scandir(PREVIEW_DIR) as it:
+        for entry in it:
+            try:
+                entries.append((entry.stat().st_mtime_ns, entry.path))
+            except OSError:
+                continue
+    if len(entries) <= Config.PREVIEW_CACHE_SIZE:
+        return
+    entries.sort(reverse=True)
+    for _, stale_path in entries[Config.PREVIEW_CACHE_SIZE:]:
+        try:
+            os.unlink(stale_path)
+        except OSError:
+            pass
+
+# Tags stripped from model output; extend the alternation to strip more in the same single pass
+_TAG_RE = re.compile(r"</?figure>")
+_NATURAL_TEXT_KEY_RE = re.compile(r'"natural_text"\s*:\s*')
+_NATURAL_TEXT_RE = re.compile(r'"natural_text"\s*:\s*("(?:[^"\\]|\\.)*")')
+_JSON_DECODER = json.JSONDecoder()
+
+def _extract_natural_text(content: str) -> str:
+    """
+    Pulls `natural_text` out of a complete response without building the full JSON object.
+    Only the matched string literal is decoded; other shapes fall back to a full parse.
+    """
+    match = _NATURAL_TEXT_RE.search(content)
+    if match is not None:
+        return _json_loads(match.group(1))
+    return _json_loads(content).get("natural_text", "")
+
+def _partial_natural_text(buffer: str) -> str:
+    """
+    Best-effort decode of the `natural_text` value from an incomplete JSON stream.
+    Returns the string content received so far, or "" if the key has not arrived.
+    """
+    match = _NATURAL_TEXT_KEY_RE.search(buffer)
+    if match is None:
+        return ""
+    fragment = buffer[match.end():]
+    # Trim up to a partial escape sequence (e.g. a cut-off \uXXXX) before closing the string
+    for trim in range(7):
+        candidate = fragment[:len(fragment) - trim]
+        for closed in (candidate, candidate + '"'):
+            try:
+                value, _ = _JSON_DECODER.raw_decode(closed)
+            except ValueError:
+                continue
+            return value if isinstance(value, str) else ""
+    return ""
+
 # --- CORE LOGIC ---
 
+def _is_pdf(file_path: str) -> bool:
+    return file_path.lower().endswith(".pdf")
+
+def _all_pages(total_pages: int, start_page: float, end_page: float, single_page: float) -> List[int]:
+    return list(range(1, total_pages + 1))
+
+def _range_pages(total_pages: int, start_page: float, end_page: float, single_page: float) -> List[int]:
+    return list(range(max(1, int(start_page)), min(total_pages, int(end_page)) + 1))
+
+def _single_page(total_pages: int, start_page: float, end_page: float, single_page: float) -> List[int]:
+    return [max(1, min(total_pages, int(single_page)))]
+
+# Thai scope labels from the page-mode radio -> page selection
+PAGE_MODE_HANDLERS: Dict[str, Callable[[int, float, float, float], List[int]]] = {
+    "ทั้งหมด": _all_pages,
+    "ช่วงหน้า": _range_pages,
+    "หน้าเดียว": _single_page,
+}
+
+@dataclass
+class RateLimiter:
+    """
+    Token-bucket limiter for request and token capacity per minute.
+    Calls are only launched when both buckets allow, avoiding 429s up front.
+    A limit of 0 disables that bucket.
+    """
+    requests_per_minute: float
+    tokens_per_minute: float
+    available_request_capacity: float = 0.0
+    available_token_capacity: float = 0.0
+    last_update_time: float = field(default_factory=time.monotonic)
+
+    def __post_init__(self):
+        self.available_request_capacity = self.requests_per_minute
+        self.available_token_capacity = self.tokens_per_minute
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self.last_update_time
+        self.available_request_capacity = min(
+            self.requests_per_minute,
+            self.available_request_capacity + self.requests_per_minute * elapsed / 60.0
+        )
+        self.available_token_capacity = min(
+            self.tokens_per_minute,
+            self.available_token_capacity + self.tokens_per_minute * elapsed / 60.0
+        )
+        self.last_update_time = now
+
+    async def acquire(self, estimated_tokens: int = 0) -> None:
+        """
+        Waits until one request and `estimated_tokens` of token budget are available,
+        then reserves both, so concurrent calls cannot all pass on the same capacity.
+        Settle the reservation with `settle_tokens` once the real usage is known.
+        """
+        # An estimate above the whole per-minute budget waits for a full bucket instead of forever
+        needed = min(estimated_tokens, self.tokens_per_minute)
+        while True:
+            self._refill()
+            has_request = not self.requests_per_minute or self.available_request_capacity >= 1
+            if needed:
+                has_tokens = not self.tokens_per_minute or self.available_token_capacity >= needed
+            else:
+                has_tokens = not self.tokens_per_minute or self.available_token_capacity > 0
+            if has_request and has_tokens:
+                if self.requests_per_minute:
+                    self.available_request_capacity -= 1
+                if self.tokens_per_minute:
+                    self.available_token_capacity -= estimated_tokens
+                return
+            await asyncio.sleep(0.1)
+
+    def settle_tokens(self, reserved: int, actual: int) -> None:
+        """Corrects a reservation made by `acquire` to the usage the call actually reported."""
+        if self.tokens_per_minute:
+            self.available_token_capacity += reserved - actual
+
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    _http2_available = True
+except ImportError:
+    _http2_available = False
+
+# One keep-alive pool for all API calls; with HTTP/2, concurrent pages multiplex over one connection
+_http_client = httpx.AsyncClient(
+    http2=_http2_available,
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    timeout=httpx.Timeout(600.0, connect=10.0),
+)
+
+
 class TyphoonOCR:
     """Core logic helper for interacting with the Typhoon OCR API."""
 
+    # Shared across instances so rebuilding the UI does not open new connections
+    _shared_client: Optional[AsyncOpenAI] = None
+
     def __init__(self):
         if not Config.BASE_URL or not Config.API_KEY:
             # In production, we might want to log this or handle it gracefully
             pass 
-        self.client = OpenAI(base_url=Config.BASE_URL, api_key=Config.API_KEY)
+        if TyphoonOCR._shared_client is None:
+            TyphoonOCR._shared_client = AsyncOpenAI(
+                base_url=Config.BASE_URL, api_key=Config.API_KEY, http_client=_http_client
+            )
+        self.client = TyphoonOCR._shared_client
+        # Shared by all pages and users of this instance
+        self.rate_limiter = RateLimiter(Config.REQUESTS_PER_MINUTE, Config.TOKENS_PER_MINUTE)
+        # Created on first use and reused across requests
+        self._render_pool: Optional[ProcessPoolExecutor] = None
+        # Main-process LRU of rendered page assets; worker caches are not shared
+        self._page_assets: "OrderedDict[tuple, PageAssets]" = OrderedDict()
+        # In-flight renders by cache key, so a Run click during preload waits instead of re-rendering
+        self._pending_assets: Dict[tuple, asyncio.Future] = {}
+        # Strong references keep fire-and-forget preload tasks alive until they finish
+        self._preload_tasks: set = set()
+
+    def _get_render_pool(self) -> ProcessPoolExecutor:
+        """Lazily creates the process pool used for CPU-bound page rendering."""
+        if self._render_pool is None:
+            # Beyond ~8 workers, Poppler rendering contends for memory bandwidth rather than scaling
+            self._render_pool = ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, 8))
+        return self._render_pool
 
-    def _get_page_count(self, file_path: str) -> int:
+    def preload_first_page(self, file_path: str) -> None:
+        """
+        Speculatively renders page 1 in the background after upload, so the
+        first page is already cached when Run is clicked. Failures are ignored;
+        the Run handler will surface them.
+        """
+        task = asyncio.get_running_loop().create_task(self._get_page_assets(file_path, "default", 1))
+        self._preload_tasks.add(task)
+        task.add_done_callback(self._preload_tasks.discard)
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def _get_page_assets(self, file_path: str, task_mode: str, page_num: int) -> PageAssets:
+        """
+        Returns the rendered assets for a page, rendering it in the
+        process pool on a cache miss so pages rasterize in parallel across cores.
+        """
+        is_pdf = _is_pdf(file_path)
+        page_num = page_num if is_pdf else 1
+        image_dim = Config.IMAGE_DIM_MIXED if is_pdf else Config.IMAGE_DIM
+        text_image_dim = Config.IMAGE_DIM_TEXT if is_pdf else Config.IMAGE_DIM
+        key = (*_file_key(file_path), page_num, task_mode, image_dim, text_image_dim, Config.TEXT_LENGTH, Config.PREVIEW_DIM)
+        if key in self._page_assets:
+            self._page_assets.move_to_end(key)
+            return self._page_assets[key]
+        if key in self._pending_assets:
+            return await asyncio.shield(self._pending_assets[key])
+
+        args = (file_path, task_mode, page_num, image_dim, text_image_dim, Config.TEXT_LENGTH, Config.PREVIEW_DIM)
+        loop = asyncio.get_running_loop()
+        render = self._pending_assets[key] = loop.run_in_executor(
+            self._get_render_pool(), _render_page_assets, *args
+        )
+        try:
+            assets = await asyncio.shield(render)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed by the OS); rebuild the pool next time and render in-process
+            self._render_pool = None
+            assets = await asyncio.to_thread(_render_page_assets, *args)
+        finally:
+            self._pending_assets.pop(key, None)
+
+        self._page_assets[key] = assets
+        if len(self._page_assets) > Config.PAGE_CACHE_SIZE:
+            self._page_assets.popitem(last=False)
+        return assets
+
+    def _get_page_count(self, file_path: str, is_pdf: Optional[bool] = None) -> int:
         """Safely retrieves page count for PDFs; returns 1 for images."""
         try:
-            if file_path and file_path.lower().endswith(".pdf"):
-                return len(PdfReader(file_path).pages)
+            if is_pdf is None:
+                is_pdf = bool(file_path) and _is_pdf(file_path)
+            if is_pdf:
+                return _page_count(*_file_key(file_path))
         except Exception:
             pass
         return 1
 
-    def _call_api_with_retry(self, func: Callable, *args, **kwargs) -> Any:
+    async def _call_api_with_retry(self, func: Callable, *args, estimated_tokens: int = 0, **kwargs) -> Any:
         """
-        Executes a function with exponential backoff retry logic.
-        Handles APIConnectionError and APITimeoutError.
+        Executes an async function with jittered backoff retry logic.
+        Handles connection/timeout errors, rate limits and 5xx responses. Each attempt
+        reserves rate-limit capacity for `estimated_tokens` first and settles it with the
+        reported usage afterwards; streamed responses report usage on their last chunk,
+        so their caller settles instead.
         """
+        waited = 0.0
         for attempt in range(Config.MAX_RETRIES):
+            await self.rate_limiter.acquire(estimated_tokens)
             try:
-                return func(*args, **kwargs)
-            except (APIConnectionError, APITimeoutError) as e:
-                if attempt == Config.MAX_RETRIES - 1:
+                response = await func(*args, **kwargs)
+            except (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError) as e:
+                # The attempt was rejected or never completed; hand its reservation back
+                self.rate_limiter.settle_tokens(estimated_tokens, 0)
+                # Honor the server's Retry-After; otherwise back off exponentially with full
+                # jitter. Total wait is capped either way.
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    delay = backoff_delay(attempt, base=2.0, cap=Config.MAX_RETRY_WAIT)
+                delay = min(delay, Config.MAX_RETRY_WAIT - waited)
+                if attempt == Config.MAX_RETRIES - 1 or delay <= 0:
                     raise e
-                time.sleep(2 ** attempt)
-            except Exception as e:
-                raise e
+                waited += delay
+                await asyncio.sleep(delay)
+                continue
+            except Exception:
+                self.rate_limiter.settle_tokens(estimated_tokens, 0)
+                raise
+            usage = getattr(response, "usage", None)
+            if usage is not None and getattr(usage, "total_tokens", None):
+                self.rate_limiter.settle_tokens(estimated_tokens, int(usage.total_tokens))
+            return response
+
+    async def _process_page_async(
+        self,
+        file_path: str,
+        task_mode: str,
+        page_num: int,
+        on_partial: Optional[Callable[[str], None]] = None,
+        file_hash: Optional[str] = None
+    ) -> Tuple[Optional[str], str]:
+        """
+        OCRs a single page and returns its preview image path and cleaned text.
+        The response is streamed; `on_partial` receives the text decoded so far
+        (at most every `Config.STREAM_INTERVAL` seconds).
+        Successful results are written to the on-disk cache when `file_hash` is given.
+        Errors are reported inline in the text so one bad page does not abort the batch.
+        """
+        image: Optional[str] = None
+        try:
+            # Prepare payload (rendering is CPU-bound, done in the process pool)
+            assets = await self._get_page_assets(file_path, task_mode, page_num)
+            messages = assets.messages
+            estimated_tokens = _estimate_request_tokens([assets])
+
+            # Gallery preview from the worker's encoded thumbnail
+            try:
+                image = _save_preview(assets.preview_bytes)
+            except Exception:
+                pass
+
+            # API Call with Retry (retries cover opening the stream)
+            stream = await self._call_api_with_retry(
+                self.client.chat.completions.create,
+                model=Config.MODEL_NAME,
+                messages=messages,
+                estimated_tokens=estimated_tokens,
+                max_tokens=Config.MAX_TOKENS,
+                stream=True,
+                stream_options={"include_usage": True},
+                extra_body={
+                    "repetition_penalty": Config.REPETITION_PENALTY,
+                    "temperature": Config.TEMPERATURE,
+                    "top_p": Config.TOP_P
+                }
+            )
+
+            chunks: List[str] = []
+            last_partial = time.monotonic()
+            async for chunk in stream:
+                if chunk.usage is not None and chunk.usage.total_tokens:
+                    self.rate_limiter.settle_tokens(estimated_tokens, int(chunk.usage.total_tokens))
+                if not chunk.choices:
+                    continue
+                chunks.append(chunk.choices[0].delta.content or "")
+                now = time.monotonic()
+                if on_partial and now - last_partial >= Config.STREAM_INTERVAL:
+                    last_partial = now
+                    on_partial(_partial_natural_text("".join(chunks)))
+
+            # Parse JSON output once the stream is complete
+            parsed_text = _extract_natural_text("".join(chunks))
+
+            # Clean tags
+            clean_text = _TAG_RE.sub("", parsed_text).strip()
+            if file_hash:
+                await asyncio.to_thread(
+                    _store_cached_page, file_hash, task_mode, page_num, assets.preview_bytes, clean_text
+                )
+            return image, clean_text
+
+        except Exception as e:
+            return image, f"❌ เกิดข้อผิดพลาดในหน้าที่ {page_num}: {str(e)}"
+
+    async def _process_batch_async(
+        self,
+        file_path: str,
+        task_mode: str,
+        page_nums: List[int],
+        file_hash: Optional[str] = None
+    ) -> Optional[Dict[int, Tuple[Optional[str], str]]]:
+        """
+        OCRs several pages with a single request.
+        Returns None on any failure (including unparseable output) so the caller
+        can fall back to per-page requests.
+        """
+        try:
+            all_assets = await asyncio.gather(
+                *(self._get_page_assets(file_path, task_mode, p) for p in page_nums)
+            )
+            if _estimate_batch_tokens(all_assets) > Config.MAX_TOKENS:
+                # The combined answer would likely be truncated; send pages separately
+                return None
+            response = await self._call_api_with_retry(
+                self.client.chat.completions.create,
+                model=Config.MODEL_NAME,
+                messages=_build_batch_messages(task_mode, list(zip(page_nums, all_assets))),
+                estimated_tokens=_estimate_request_tokens(all_assets),
+                max_tokens=Config.MAX_TOKENS,
+                extra_body={
+                    "repetition_penalty": Config.REPETITION_PENALTY,
+                    "temperature": Config.TEMPERATURE,
+                    "top_p": Config.TOP_P
+                }
+            )
+            texts = _parse_batch_response(response.choices[0].message.content, page_nums)
+        except Exception:
+            return None
+
+        results: Dict[int, Tuple[Optional[str], str]] = {}
+        for page_num, assets in zip(page_nums, all_assets):
+            try:
+                image = _save_preview(assets.preview_bytes)
+            except Exception:
+                image = None
+            results[page_num] = (image, _TAG_RE.sub("", texts[page_num]).strip())
+            if file_hash:
+                await asyncio.to_thread(
+                    _store_cached_page, file_hash, task_mode, page_num, assets.preview_bytes, results[page_num][1]
+                )
+        return results
 
-    def process_document(
+    async def process_document(
         self,
         file_obj: Any,
         task_mode: str,
@@ -503,85 +813,159 @@ class TyphoonOCR:
         single_page: float,
         start_page: float,
         end_page: float,
+        force_refresh: bool = False,
         progress: gr.Progress = gr.Progress(track_tqdm=True)
-    ) -> Tuple[List[Image.Image], str]:
+    ) -> AsyncIterator[Tuple[List[str], str]]:
         """
         Main processing function triggered by the UI.
         Handles page selection logic, API calls with retry, and result aggregation.
+        Pages found in the on-disk result cache are returned without re-OCR
+        unless `force_refresh` is set.
+        Yields (images, text) snapshots in page order as pages stream in.
         """
         if not file_obj:
-            return [], "⚠️ กรุณาอัปโหลดไฟล์ก่อนเริ่ม"
+            yield [], "⚠️ กรุณาอัปโหลดไฟล์ก่อนเริ่ม"
+            return
 
         file_path = file_obj.name
-        is_pdf = file_path.lower().endswith(".pdf")
-        total_pages = self._get_page_count(file_path)
+        is_pdf = _is_pdf(file_path)
+        # Page counting parses the PDF; keep it off the event loop
+        total_pages = await asyncio.to_thread(self._get_page_count, file_path, is_pdf)
 
-        # Determine target pages
+        # Determine target pages (images are always a single page)
         target_pages: List[int] = [1]
-        
-        # Mapping Thai scope labels to logic
-        # scope_mode values: ["ทั้งหมด", "ช่วงหน้า", "หน้าเดียว"]
-        
         if is_pdf:
-            if scope_mode == "ทั้งหมด":
-                target_pages = list(range(1, total_pages + 1))
-            elif scope_mode == "ช่วงหน้า":
-                s = max(1, int(start_page))
-                e = min(total_pages, int(end_page))
-                target_pages = list(range(s, e + 1))
-            else: # "หน้าเดียว"
-                p = max(1, min(total_pages, int(single_page)))
-                target_pages = [p]
-
-        images: List[Image.Image] = []
-        text_parts: List[str] = []
+            select_pages = PAGE_MODE_HANDLERS.get(scope_mode, _single_page)
+            target_pages = select_pages(total_pages, start_page, end_page, single_page)
+
         total_targets = len(target_pages)
+        events: asyncio.Queue = asyncio.Queue()
+        semaphore = asyncio.Semaphore(max(1, Config.CONCURRENCY))
 
-        for idx, page_num in enumerate(target_pages, 1):
-            progress((idx - 1, total_targets), desc=f"กำลังประมวลผลหน้าที่ {page_num}")
-            
+        async def _run(page_num: int) -> None:
             try:
-                # Prepare payload
-                messages = prepare_ocr_messages(
-                    file_path, task_mode, Config.IMAGE_DIM, Config.TEXT_LENGTH, page_num
-                )
-                
-                # Extract image preview from payload (Base64)
+                async with semaphore:
+                    result = await self._process_page_async(
+                        file_path, task_mode, page_num,
+                        on_partial=lambda text: events.put_nowait((page_num, None, text)),
+                        file_hash=file_hash
+                    )
+            except Exception as e:
+                result = (None, f"❌ เกิดข้อผิดพลาดในหน้าที่ {page_num}: {str(e)}")
+            events.put_nowait((page_num, result, None))
+
+        async def _run_group(page_nums: List[int]) -> None:
+            results = None
+            if len(page_nums) > 1:
+                async with semaphore:
+                    results = await self._process_batch_async(file_path, task_mode, page_nums, file_hash)
+            if results is None:
+                # Single page, or the batch failed: one streamed request per page
+                await asyncio.gather(*(_run(p) for p in page_nums))
+                return
+            for page_num in page_nums:
+                events.put_nowait((page_num, results[page_num], None))
+
+        # Leading run of finished pages, appended once instead of re-joined on every yield
+        done_text = StringIO()
+        done_images: List[str] = []
+        done_count = 0
+
+        def _snapshot() -> Tuple[List[str], str]:
+            # Assemble in page order so output is deterministic regardless of completion order
+            nonlocal done_count
+            while done_count < total_targets and target_pages[done_count] in page_results:
+                image, text = page_results[target_pages[done_count]]
+                if image is not None:
+                    done_images.append(image)
+                if done_count:
+                    done_text.write("\n\n")
+                done_text.write(text)
+                done_count += 1
+
+            images = list(done_images)
+            text_parts: List[str] = [done_text.getvalue()] if done_count else []
+            for page_num in target_pages[done_count:]:
+                if page_num in page_results:
+                    image, text = page_results[page_num]
+                    if image is not None:
+                        images.append(image)
+                    text_parts.append(text)
+                elif page_num in partial_texts:
+                    text_parts.append(partial_texts[page_num])
+            return images, "\n\n".join(text_parts)
+
+        page_results: Dict[int, Tuple[Optional[str], str]] = {}
+        partial_texts: Dict[int, str] = {}
+
+        # Serve previously OCR'd pages from the on-disk cache
+        try:
+            file_hash: Optional[str] = await asyncio.to_thread(lambda: _file_hash(*_file_key(file_path)))
+        except OSError:
+            file_hash = None
+        pending_pages = target_pages
+        if file_hash and not force_refresh:
+            pending_pages = []
+            for page_num in target_pages:
+                cached = await asyncio.to_thread(_load_cached_page, file_hash, task_mode, page_num)
+                if cached is None:
+                    pending_pages.append(page_num)
+                    continue
+                preview_bytes, text = cached
                 try:
-                    img_data = messages[0]["content"][1]["image_url"]["url"].split(",")[-1]
-                    pil_img = Image.open(BytesIO(base64.b64decode(img_data)))
-                    images.append(pil_img)
+                    image = _save_preview(preview_bytes)
                 except Exception:
-                    pass
-                
-                # API Call with Retry
-                response = self._call_api_with_retry(
-                    self.client.chat.completions.create,
-                    model=Config.MODEL_NAME,
-                    messages=messages,
-                    max_tokens=Config.MAX_TOKENS,
-                    extra_body={
-                        "repetition_penalty": Config.REPETITION_PENALTY,
-                        "temperature": Config.TEMPERATURE,
-                        "top_p": Config.TOP_P
-                    }
-                )
-                
-                # Parse JSON output
-                content = response.choices[0].message.content
-                parsed_text = json.loads(content).get("natural_text", "")
-                
-                # Clean tags
-                clean_text = parsed_text.replace("<figure>", "").replace("</figure>", "").strip()
-                text_parts.append(clean_text)
+                    image = None
+                page_results[page_num] = (image, text)
 
-            except Exception as e:
-                text_parts.append(f"❌ เกิดข้อผิดพลาดในหน้าที่ {page_num}: {str(e)}")
+        # Pages are independent, I/O-bound API calls; overlap up to CONCURRENCY round-trips on the event loop
+        progress((len(page_results), total_targets), desc=f"กำลังประมวลผล {total_targets} หน้า")
+        batch_size = max(1, Config.PAGES_PER_REQUEST)
+        groups = [pending_pages[i:i + batch_size] for i in range(0, len(pending_pages), batch_size)]
+        tasks = [asyncio.create_task(_run_group(g)) for g in groups]
+        try:
+            while len(page_results) < total_targets:
+                page_num, result, partial = await events.get()
+                if result is None:
+                    partial_texts[page_num] = partial
+                else:
+                    page_results[page_num] = result
+                    progress((len(page_results), total_targets), desc=f"ประมวลผลหน้าที่ {page_num} เสร็จแล้ว")
+                if events.empty():
+                    yield _snapshot()
+        finally:
+            for task in tasks:
+                task.cancel()
 
-        return images, "\n\n".join(text_parts)
+        yield _snapshot()
 
 # --- UI CONSTRUCTION ---
 
+class StaticCacheMiddleware:
+    """ASGI middleware marking versioned static assets as immutable for the browser cache."""
+
+    CACHE_CONTROL = (b"cache-control", b"public, max-age=31536000, immutable")
+
+    def __init__(self, app):
+        self.app = app
+        self.prefix = f"file={STATIC_DIR.as_posix()}/"
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or self.prefix not in scope["path"]
+            or b"v=" not in scope.get("query_string", b"")
+        ):
+            return await self.app(scope, receive, send)
+
+        async def send_with_cache(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                headers = [h for h in message.get("headers", []) if h[0].lower() != b"cache-control"]
+                message["headers"] = headers + [self.CACHE_CONTROL]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cache)
+
 def _build_header() -> None:
     """Renders the top navigation bar."""
     with gr.Row(elem_classes=["header-container"]):
@@ -638,6 +1022,9 @@ def _build_left_panel(ocr_instance: TyphoonOCR) -> dict:
                     ["default", "structure"], 
                     label="โหมดการอ่าน", value="default", container=False
                 )
+                ui_elements["force_refresh"] = gr.Checkbox(
+                    label="ประมวลผลใหม่ (ไม่ใช้ผลลัพธ์ที่แคชไว้)", value=False
+                )
 
         ui_elements["btn_run"] = gr.Button("เริ่มประมวลผล", elem_classes=["primary-btn"])
         
@@ -705,7 +1092,10 @@ def create_ui() -> gr.Blocks:
         layout_gap="6px"
     )
 
-    with gr.Blocks(theme=theme, css=APP_CSS, title=APP_TITLE) as demo:
+    # Serve the stylesheet straight from disk so browsers can cache it across reloads
+    gr.set_static_paths(paths=[STATIC_DIR])
+
+    with gr.Blocks(theme=theme, head=APP_HEAD, title=APP_TITLE) as demo:
         _build_header()
         
         with gr.Row():
@@ -713,15 +1103,16 @@ def create_ui() -> gr.Blocks:
             right = _build_right_panel()
 
         # Event: File Upload Interaction
-        def update_status(f):
+        async def update_status(f):
             if not f:
                 return (
                     """<div class="status-bar"><div class="status-dot"></div><span>รออัปโหลดไฟล์...</span></div>""",
                     gr.update(visible=False), 1, 1, 1
                 )
             
-            total = ocr_service._get_page_count(f.name)
-            is_pdf = f.name.lower().endswith(".pdf")
+            is_pdf = _is_pdf(f.name)
+            total = await asyncio.to_thread(ocr_service._get_page_count, f.name, is_pdf)
+            ocr_service.preload_first_page(f.name)
             status_text = f"พร้อมทำงาน • {'PDF' if is_pdf else 'รูปภาพ'} • {total} หน้า"
             
             return (
@@ -730,10 +1121,13 @@ def create_ui() -> gr.Blocks:
                 total, 1, total
             )
 
-        left["file_input"].change(
+        # Coalesce bursts of change events; only the latest pending one runs
+        gr.on(
+            triggers=[left["file_input"].change],
             fn=update_status, 
             inputs=[left["file_input"]], 
-            outputs=[left["status_bar"], left["page_mode"], left["page_num"], left["start_p"], left["end_p"]]
+            outputs=[left["status_bar"], left["page_mode"], left["page_num"], left["start_p"], left["end_p"]],
+            trigger_mode="always_last"
         )
 
         # Event: Visibility Toggles
@@ -748,7 +1142,7 @@ def create_ui() -> gr.Blocks:
             fn=ocr_service.process_document,
             inputs=[
                 left["file_input"], left["task_mode"], left["page_mode"],
-                left["page_num"], left["start_p"], left["end_p"]
+                left["page_num"], left["start_p"], left["end_p"], left["force_refresh"]
             ],
             outputs=[right["out_gal"], right["out_txt"]]
         )
@@ -763,4 +1157,12 @@ def create_ui() -> gr.Blocks:
     return demo
 
 if __name__ == "__main__":
-    create_ui().launch(share=False)
+    # Startup work runs only for the launched app, not on import or in render workers
+    _check_system_requirements()
+    # Previews from earlier runs are not referenced by anything anymore
+    shutil.rmtree(PREVIEW_DIR, ignore_errors=True)
+    threading.Thread(target=_prune_result_cache, daemon=True).start()
+    create_ui().launch(
+        share=False,
+        app_kwargs={"middleware": [Middleware(StaticCacheMiddleware)]},
+    )
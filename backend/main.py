@@ -20,10 +20,42 @@ if poppler_path.exists():
     os.environ["PATH"] += os.pathsep + str(poppler_path.absolute())
 
 from contextlib import asynccontextmanager
+from urllib.parse import parse_qs
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 
 from routes.ocr import router as ocr_router
+from services.ocr_service import close_shared_resources
+
+
+# Values FastAPI parses as True for a bool query parameter
+_TRUTHY = {"1", "true", "t", "on", "yes", "y"}
+
+
+def _is_stream_request(scope) -> bool:
+    """True for the SSE route and for `/api/ocr?stream=true`, which answers with NDJSON."""
+    path = scope["path"]
+    if path == "/api/ocr/stream":
+        return True
+    if path == "/api/ocr":
+        stream = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("stream", [""])[-1]
+        return stream.lower() in _TRUTHY
+    return False
+
+
+class StreamAwareGZipMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware that passes the streaming routes through untouched. Starlette only
+    skips text/event-stream from 0.41 on, and never NDJSON; compressing either buffers
+    events until the compressor flushes, so pages would stop arriving one at a time.
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and _is_stream_request(scope):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
 
 
 @asynccontextmanager
@@ -32,6 +64,7 @@ async def lifespan(app: FastAPI):
     print("🚀 Typhoon OCR Backend starting...")
     yield
     print("👋 Typhoon OCR Backend shutting down...")
+    await close_shared_resources()
 
 
 app = FastAPI(
@@ -53,6 +86,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large markdown/JSON responses; the SSE and NDJSON streams are never compressed
+app.add_middleware(StreamAwareGZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # Include routers
 app.include_router(ocr_router)
 
@@ -65,4 +101,9 @@ async def health_check():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8345)
+
+    # uvicorn[standard] installs uvloop (not on Windows) and httptools; "auto" uses them when present.
+    # Extra worker processes are opt-in: each gets its own event loop, HTTP pool, render pool,
+    # caches and TYPHOON_CONCURRENCY limit, so upstream concurrency scales with the count.
+    workers = max(1, int(os.getenv("BACKEND_WORKERS", "1") or 1))
+    uvicorn.run("main:app", host="0.0.0.0", port=8345, loop="auto", http="auto", workers=workers)
@@ -5,23 +5,98 @@ OCR Routes Module
 FastAPI routes for OCR processing endpoints.
 """
 
+import asyncio
 import json
 import os
+import re
 import tempfile
 import shutil
 import time
-from typing import List, Optional, AsyncGenerator
+from typing import Any, AsyncGenerator, List, Optional
 
-from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+from fastapi import APIRouter, File, Form, HTTPException, Query, UploadFile
 from fastapi.responses import StreamingResponse
 from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
 from services.ocr_service import get_ocr_service, OcrResult, OcrPageResult
 
+try:
+    import orjson
+
+    def _json_dumps(obj: Any) -> str:
+        """Serializes SSE payloads; the final event carries every page's text and image."""
+        return orjson.dumps(obj).decode("utf-8")
+except ImportError:
+    _json_dumps = json.dumps
+
 
 router = APIRouter(tags=["OCR"])
 
+ALLOWED_EXTENSIONS = frozenset({".pdf", ".png", ".jpg", ".jpeg", ".webp", ".gif"})
+_ALLOWED_EXTENSIONS_TEXT = ", ".join(sorted(ALLOWED_EXTENSIONS))
+
+
+def _file_extension(filename: Optional[str]) -> str:
+    """Lower-cased extension including the dot, or "" when there is none."""
+    name = filename or ""
+    _, dot, ext = name.rpartition(".")
+    return f".{ext.lower()}" if dot and ext else ""
+
+
+_PAGE_SPEC_RE = re.compile(r"\s*(\d+)\s*(?:-\s*(\d+)\s*)?")
+
+
+def _parse_pages(pages: str) -> List[int]:
+    """
+    Expands a page spec such as "1-3,5" into sorted, unique page numbers.
+    Ranges are merged before expansion, so overlapping or large ranges are
+    never materialized twice or re-sorted. Raises ValueError on bad input.
+    """
+    ranges = []
+    for part in pages.split(","):
+        if not part.strip():
+            continue
+        match = _PAGE_SPEC_RE.fullmatch(part)
+        if match is None:
+            raise ValueError(f"Invalid page spec: {part!r}")
+        start = int(match.group(1))
+        end = int(match.group(2) or start)
+        ranges.append((min(start, end), max(start, end)))
+
+    ranges.sort()
+    merged: List[List[int]] = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [page for start, end in merged for page in range(start, end + 1)]
+
+
+# Upload spool chunk; large enough to keep syscalls few, small enough to keep memory flat
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def _default_upload_dir() -> Optional[str]:
+    """Spool directory for uploads: TYPHOON_UPLOAD_DIR when set, else the system temp dir."""
+    # tmpfs such as /dev/shm is opt-in only: containers often cap it at 64 MB, and
+    # spooled PDFs would sit in RAM next to the render pool
+    return os.getenv("TYPHOON_UPLOAD_DIR") or None
+
+
+UPLOAD_DIR = _default_upload_dir()
+
+
+async def _save_upload(file: UploadFile, path: str) -> None:
+    """Streams an upload to disk chunk by chunk without blocking the event loop."""
+    buffer = await run_in_threadpool(open, path, "wb")
+    try:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await run_in_threadpool(buffer.write, chunk)
+    finally:
+        await run_in_threadpool(buffer.close)
+
 
 class OcrPageResponse(BaseModel):
     """Response model for a single page result."""
@@ -57,7 +132,8 @@ async def process_ocr(
     temperature: float = Form(default=0.1, description="Temperature (0.0-1.0)"),
     top_p: float = Form(default=0.6, description="Top P (0.0-1.0)"),
     repetition_penalty: float = Form(default=1.2, description="Repetition penalty"),
-    pages: Optional[str] = Form(default=None, description="Comma-separated page numbers (e.g., '1,2,3')")
+    pages: Optional[str] = Form(default=None, description="Comma-separated page numbers (e.g., '1,2,3')"),
+    stream: bool = Query(default=False, description="Stream one NDJSON line per finished page")
 ):
     """
     Process a document with Typhoon OCR.
@@ -70,48 +146,50 @@ async def process_ocr(
     - **top_p**: Top-p sampling
     - **repetition_penalty**: Repetition penalty
     - **pages**: Specific pages to process (comma-separated)
+    - **stream** (query): Respond with `application/x-ndjson`, one `{"type": "page", ...}`
+      line per page as it finishes (not in page order), then a `{"type": "complete", ...}` line
     """
     # Validate file type
-    allowed_extensions = {".pdf", ".png", ".jpg", ".jpeg", ".webp", ".gif"}
-    file_ext = os.path.splitext(file.filename or "")[1].lower()
+    file_ext = _file_extension(file.filename)
     
-    if file_ext not in allowed_extensions:
+    if file_ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(
             status_code=400, 
-            detail=f"Unsupported file type: {file_ext}. Allowed: {', '.join(allowed_extensions)}"
+            detail=f"Unsupported file type: {file_ext}. Allowed: {_ALLOWED_EXTENSIONS_TEXT}"
         )
     
     # Parse pages parameter
     page_list: Optional[List[int]] = None
     if pages:
         try:
-            page_list = []
-            for part in pages.split(","):
-                part = part.strip()
-                if not part:
-                    continue
-                if "-" in part:
-                    start, end = map(int, part.split("-"))
-                    if start > end:
-                         start, end = end, start
-                    page_list.extend(range(start, end + 1))
-                else:
-                    page_list.append(int(part))
-            # Sort and unique
-            page_list = sorted(list(set(page_list)))
+            page_list = _parse_pages(pages)
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid pages format. Use comma-separated numbers or ranges (e.g., '1-3,5').")
     
     # Save uploaded file to temp location
-    temp_dir = tempfile.mkdtemp()
+    temp_dir = tempfile.mkdtemp(dir=UPLOAD_DIR)
     temp_path = os.path.join(temp_dir, file.filename or "uploaded_file")
     
     try:
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        await _save_upload(file, temp_path)
         
         # Process with OCR service
         service = get_ocr_service()
+        if stream:
+            ndjson = _ndjson_stream(
+                service, temp_dir, temp_path,
+                task_type=task_type,
+                model=model,
+                pages=page_list,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                repetition_penalty=repetition_penalty
+            )
+            # The stream owns the temp dir from here on
+            temp_dir = None
+            return StreamingResponse(ndjson, media_type="application/x-ndjson")
+
         result: OcrResult = await service.process_document(
             file_path=temp_path,
             task_type=task_type,
@@ -146,7 +224,38 @@ async def process_ocr(
         
     finally:
         # Cleanup temp files
-        shutil.rmtree(temp_dir, ignore_errors=True)
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+async def _ndjson_stream(service, temp_dir: str, temp_path: str, **options: Any) -> AsyncGenerator[str, None]:
+    """Yields one JSON line per finished page, then a summary line; removes the upload when done."""
+    start_time = time.time()
+    total_tokens = 0
+    success = True
+    try:
+        async for page_result, page_tokens in service.iter_document(file_path=temp_path, **options):
+            total_tokens += page_tokens
+            success = success and page_result.success
+            yield _json_dumps({
+                'type': 'page',
+                'page': page_result.page,
+                'success': page_result.success,
+                'text': page_result.text,
+                'image_base64': page_result.image_base64,
+                'error': page_result.error
+            }) + "\n"
+        yield _json_dumps({
+            'type': 'complete',
+            'success': success,
+            'total_tokens': total_tokens,
+            'processing_time': round(time.time() - start_time, 2),
+            'error': None
+        }) + "\n"
+    except Exception as e:
+        yield _json_dumps({'type': 'error', 'message': str(e)}) + "\n"
+    finally:
+        await asyncio.to_thread(shutil.rmtree, temp_dir, ignore_errors=True)
 
 
 @router.get("/api/models", response_model=List[ModelInfo])
@@ -169,20 +278,12 @@ async def get_page_count(
     if not file.filename or not file.filename.lower().endswith(".pdf"):
         return {"page_count": 1, "is_pdf": False}
     
-    temp_dir = tempfile.mkdtemp()
-    temp_path = os.path.join(temp_dir, file.filename)
+    # Counting pages only needs the xref/page tree, so parse the upload in memory
+    data = await file.read()
+    service = get_ocr_service()
+    page_count = await run_in_threadpool(service.get_page_count_from_bytes, data)
     
-    try:
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        service = get_ocr_service()
-        page_count = service.get_page_count(temp_path)
-        
-        return {"page_count": page_count, "is_pdf": True}
-        
-    finally:
-        shutil.rmtree(temp_dir, ignore_errors=True)
+    return {"page_count": page_count, "is_pdf": True}
 
 
 @router.post("/api/ocr/stream")
@@ -206,42 +307,32 @@ async def process_ocr_stream(
     - {"type": "complete", "success": bool, "total_tokens": N, "processing_time": T}
     """
     # Validate file type
-    allowed_extensions = {".pdf", ".png", ".jpg", ".jpeg", ".webp", ".gif"}
-    file_ext = os.path.splitext(file.filename or "")[1].lower()
+    file_ext = _file_extension(file.filename)
     
-    if file_ext not in allowed_extensions:
+    if file_ext not in ALLOWED_EXTENSIONS:
         async def error_stream():
-            yield f"data: {json.dumps({'type': 'error', 'message': f'Unsupported file type: {file_ext}'})}\n\n"
+            yield f"data: {_json_dumps({'type': 'error', 'message': f'Unsupported file type: {file_ext}'})}\n\n"
         return StreamingResponse(error_stream(), media_type="text/event-stream")
     
     # Parse pages parameter
     page_list: Optional[List[int]] = None
     if pages:
         try:
-            page_list = []
-            for part in pages.split(","):
-                part = part.strip()
-                if not part:
-                    continue
-                if "-" in part:
-                    start, end = map(int, part.split("-"))
-                    if start > end:
-                        start, end = end, start
-                    page_list.extend(range(start, end + 1))
-                else:
-                    page_list.append(int(part))
-            page_list = sorted(list(set(page_list)))
+            page_list = _parse_pages(pages)
         except ValueError:
             async def error_stream():
-                yield f"data: {json.dumps({'type': 'error', 'message': 'Invalid pages format'})}\n\n"
+                yield f"data: {_json_dumps({'type': 'error', 'message': 'Invalid pages format'})}\n\n"
             return StreamingResponse(error_stream(), media_type="text/event-stream")
     
     # Save uploaded file to temp location
-    temp_dir = tempfile.mkdtemp()
+    temp_dir = tempfile.mkdtemp(dir=UPLOAD_DIR)
     temp_path = os.path.join(temp_dir, file.filename or "uploaded_file")
     
-    with open(temp_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    try:
+        await _save_upload(file, temp_path)
+    except Exception:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
     
     async def generate_stream() -> AsyncGenerator[str, None]:
         start_time = time.time()
@@ -253,7 +344,7 @@ async def process_ocr_stream(
         # Increase padding to 4KB for even better buffer flushing
         padding = ":" + " " * 4096 + "\n\n"
         yield padding
-        yield f"data: {json.dumps({'type': 'progress', 'current': 0, 'total': 0, 'message': 'Establishing connection...'})}\n\n"
+        yield f"data: {_json_dumps({'type': 'progress', 'current': 0, 'total': 0, 'message': 'Establishing connection...'})}\n\n"
         
         try:
             # 2. Get page count (This might take a moment)
@@ -272,9 +363,9 @@ async def process_ocr_stream(
             total_targets = len(target_pages)
             
             # 3. Send the official START event
-            yield f"data: {json.dumps({'type': 'start', 'total_pages': total_targets, 'total': total_targets})}\n\n"
+            yield f"data: {_json_dumps({'type': 'start', 'total_pages': total_targets, 'total': total_targets})}\n\n"
             
-            semaphore = asyncio.Semaphore(5)
+            semaphore = asyncio.Semaphore(service.config.CONCURRENCY)
             
             async def process_page_with_semaphore(p_num):
                 async with semaphore:
@@ -295,14 +386,14 @@ async def process_ocr_stream(
             # Process results in order
             for idx, task in enumerate(tasks, 1):
                 # Send progress event for UI update (even though it's processing in parallel)
-                yield f"data: {json.dumps({'type': 'progress', 'current': idx, 'total': total_targets, 'page': target_pages[idx-1]})}\n\n"
+                yield f"data: {_json_dumps({'type': 'progress', 'current': idx, 'total': total_targets, 'page': target_pages[idx-1]})}\n\n"
                 
                 page_result, page_tokens = await task
                 results.append(page_result)
                 total_tokens += page_tokens
 
                 # Send page complete event
-                yield f"data: {json.dumps({'type': 'page_complete', 'page': page_result.page, 'success': page_result.success, 'text': page_result.text[:200] + '...' if len(page_result.text) > 200 else page_result.text, 'image_base64': page_result.image_base64[:100] if page_result.image_base64 else '', 'error': page_result.error})}\n\n"
+                yield f"data: {_json_dumps({'type': 'page_complete', 'page': page_result.page, 'success': page_result.success, 'text': page_result.text[:200] + '...' if len(page_result.text) > 200 else page_result.text, 'image_base64': page_result.image_base64[:100] if page_result.image_base64 else '', 'error': page_result.error})}\n\n"
             
             processing_time = round(time.time() - start_time, 2)
             
@@ -318,10 +409,10 @@ async def process_ocr_stream(
                 for r in results
             ]
             
-            yield f"data: {json.dumps({'type': 'complete', 'success': all(r.success for r in results), 'results': final_results, 'total_tokens': total_tokens, 'processing_time': processing_time})}\n\n"
+            yield f"data: {_json_dumps({'type': 'complete', 'success': all(r.success for r in results), 'results': final_results, 'total_tokens': total_tokens, 'processing_time': processing_time})}\n\n"
             
         except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+            yield f"data: {_json_dumps({'type': 'error', 'message': str(e)})}\n\n"
         
         finally:
             # Cleanup temp files
@@ -8,21 +8,61 @@ Handles document processing, API calls, and result formatting using asynchronous
 
 import asyncio
 import base64
+import binascii
+import hashlib
 import json
 import os
+import pickle
 import re
-import subprocess
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass, field
+from functools import lru_cache, partial
+from io import BytesIO
 from pathlib import Path
-from typing import Any, Callable, List, Optional, Tuple
+from typing import Any, AsyncIterator, Callable, List, Optional, Tuple
 
+import httpx
 from dotenv import load_dotenv
-from openai import APIConnectionError, APITimeoutError, AsyncOpenAI
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    AsyncOpenAI,
+    InternalServerError,
+    RateLimitError,
+)
+from PIL import Image
 from pypdf import PdfReader
 
-import typhoon_ocr.ocr_utils
-from typhoon_ocr import prepare_ocr_messages
+from typhoon_ocr.ocr_utils import _pdf_reader, _pdf_reader_lock, prepare_ocr_messages_with_image
+from typhoon_ocr.retry_utils import backoff_delay, retry_after_seconds
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+try:
+    import pybase64
+    _b64decode = pybase64.b64decode
+    _b64encode = pybase64.b64encode
+except ImportError:
+    _b64decode = binascii.a2b_base64
+    _b64encode = partial(binascii.b2a_base64, newline=False)
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    _http2_available = True
+except ImportError:
+    _http2_available = False
 
 load_dotenv()
 
@@ -38,8 +78,15 @@ class Config:
     TEMPERATURE: float = 0.1
     TOP_P: float = 0.6
     MAX_RETRIES: int = 5
+    MAX_BACKOFF: float = 60.0
+    CONCURRENCY: int = field(default_factory=lambda: int(os.getenv("TYPHOON_CONCURRENCY", "5") or 5))
     IMAGE_DIM: int = 1800
     TEXT_LENGTH: int = 8000
+    # Re-encoding of the preview returned to the frontend; the model still gets the original render
+    PREVIEW_FORMAT: str = "JPEG"
+    PREVIEW_QUALITY: int = 80
+    # Optional object-store prefix; page images are PUT there and sent to the model by URL
+    IMAGE_UPLOAD_URL: str = field(default_factory=lambda: os.getenv("TYPHOON_IMAGE_UPLOAD_URL", ""))
 
 
 @dataclass
@@ -62,46 +109,99 @@ class OcrResult:
     error: Optional[str] = None
 
 
-def _apply_windows_patches() -> None:
+# One keep-alive pool for all API calls; with HTTP/2, concurrent pages multiplex over one connection
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    """Returns the shared HTTP pool, creating it on first use and again after shutdown closed it."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            http2=_http2_available,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+            timeout=httpx.Timeout(600.0, connect=10.0),
+        )
+    return _http_client
+
+
+# Shared across requests; created on first render
+_render_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_render_pool() -> ProcessPoolExecutor:
     """
-    Applies a monkey patch to fix Windows encoding issues with pdfinfo.
+    Lazily creates the process pool used for CPU-bound page rasterization.
+    The cores are split between BACKEND_WORKERS server processes, each with its own pool.
     """
-    def patched_get_pdf_media_box_width_height(local_pdf_path: str, page_num: int) -> Tuple[float, float]:
-        command = [
-            "pdfinfo", "-f", str(page_num), "-l", str(page_num), "-box",
-            "-enc", "UTF-8", local_pdf_path
-        ]
-        try:
-            result = subprocess.run(
-                command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                text=True, encoding='utf-8', errors='replace',
-                timeout=30  # Add timeout to prevent hanging
-            )
-        except subprocess.TimeoutExpired:
-            raise ValueError(f"pdfinfo timed out after 30 seconds for {local_pdf_path}")
-        except FileNotFoundError:
-            raise ValueError("pdfinfo utility not found. Please ensure Poppler is installed and in PATH.")
+    global _render_pool
+    if _render_pool is None:
+        server_workers = max(1, int(os.getenv("BACKEND_WORKERS", "1") or 1))
+        _render_pool = ProcessPoolExecutor(max_workers=max(1, min(os.cpu_count() or 1, 8) // server_workers))
+    return _render_pool
 
-        if result.returncode != 0:
-            raise ValueError(f"Error running pdfinfo: {result.stderr}")
 
-        for line in result.stdout.splitlines():
-            if "MediaBox" in line:
-                try:
-                    parts = line.split(":")[1].split()
-                    return (
-                        abs(float(parts[0]) - float(parts[2])),
-                        abs(float(parts[3]) - float(parts[1]))
-                    )
-                except (IndexError, ValueError):
-                    continue
-        raise ValueError("MediaBox not found")
+def _reset_render_pool() -> None:
+    """Drops the pool so the next render recreates it (e.g. after a worker crash)."""
+    global _render_pool
+    _render_pool = None
 
-    typhoon_ocr.ocr_utils.get_pdf_media_box_width_height = patched_get_pdf_media_box_width_height
 
+_FENCED_JSON_RE = re.compile(r"```(?:json)?\s*(\{[\s\S]*?\})\s*```", re.IGNORECASE)
+_FIGURE_TAG_RE = re.compile(r"</?figure>")
 
-# Apply patches on module load
-_apply_windows_patches()
+# PDFium is not thread-safe and page counts run in worker threads
+_pdfium_lock = threading.Lock()
+
+
+def _file_key(file_path: str) -> Tuple[str, int, int]:
+    """Returns the (path, mtime_ns, size) cache key for a file."""
+    stat = os.stat(file_path)
+    return file_path, stat.st_mtime_ns, stat.st_size
+
+
+@lru_cache(maxsize=128)
+def _page_count(path: str, mtime_ns: int, size: int) -> int:
+    """Counts PDF pages once per file version; (mtime, size) invalidate stale entries."""
+    if pdfium is not None:
+        # One small-buffered sync handle; PDFium reads only the xref/page tree from it
+        with open(path, "rb", buffering=4096) as f, _pdfium_lock:
+            pdf = pdfium.PdfDocument(f)
+            try:
+                return len(pdf)
+            finally:
+                pdf.close()
+    with _pdf_reader_lock:
+        return _pdf_reader(path, mtime_ns, size).get_num_pages()
+
+
+def _encode_preview(image_base64: str, preview_format: str, preview_quality: int) -> str:
+    """Re-encodes a page render as a lossy preview; PNG renders shrink several-fold."""
+    img = Image.open(BytesIO(_b64decode(image_base64)))
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    buffer = BytesIO()
+    img.save(buffer, format=preview_format, quality=preview_quality)
+    return _b64encode(buffer.getvalue()).decode("ascii")
+
+
+def _render_page(
+    file_path: str, task_type: str, image_dim: int, text_length: int, page_num: int,
+    preview_format: str = "JPEG", preview_quality: int = 80
+) -> Tuple[List[dict], str]:
+    """
+    `prepare_ocr_messages` plus the page's preview image (base64), re-encoded as
+    `preview_format` for the response.
+    Runs in the render process pool; module-level so workers can unpickle it.
+    """
+    messages, image_base64 = prepare_ocr_messages_with_image(
+        file_path,
+        task_type=task_type,
+        target_image_dim=image_dim,
+        target_text_length=text_length,
+        page_num=page_num,
+    )
+    return messages, _encode_preview(image_base64, preview_format, preview_quality)
 
 
 class TyphoonOCRService:
@@ -109,34 +209,83 @@ class TyphoonOCRService:
 
     def __init__(self, config: Optional[Config] = None):
         self.config = config or Config()
-        self.client = AsyncOpenAI(
-            base_url=self.config.BASE_URL,
-            api_key=self.config.API_KEY
-        )
+        self._client: Optional[AsyncOpenAI] = None
+        self._client_http: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        """API client on the shared HTTP pool; rebuilt when a lifespan shutdown replaced the pool."""
+        http_client = _get_http_client()
+        if self._client is None or self._client_http is not http_client:
+            self._client = AsyncOpenAI(
+                base_url=self.config.BASE_URL,
+                api_key=self.config.API_KEY,
+                http_client=http_client
+            )
+            self._client_http = http_client
+        return self._client
 
     def get_page_count(self, file_path: str) -> int:
         """Safely retrieves page count for PDFs; returns 1 for images."""
         try:
             if file_path and file_path.lower().endswith(".pdf"):
-                return len(PdfReader(file_path).pages)
+                return _page_count(*_file_key(file_path))
         except Exception:
             pass
         return 1
 
+    def get_page_count_from_bytes(self, data: bytes) -> int:
+        """Page count for an in-memory PDF; only the xref/page tree is parsed."""
+        try:
+            if pdfium is not None:
+                with _pdfium_lock:
+                    pdf = pdfium.PdfDocument(data)
+                    try:
+                        return len(pdf)
+                    finally:
+                        pdf.close()
+            return len(PdfReader(BytesIO(data), strict=False).pages)
+        except Exception:
+            return 1
+
     async def _call_api_with_retry(self, func: Callable, *args, **kwargs) -> Any:
         """
-        Executes an async function with exponential backoff retry logic.
+        Executes an async function with jittered exponential backoff retry logic.
+        Retries connection/timeout errors, rate limits (429) and 5xx responses,
+        waiting for the server's Retry-After when it sends one.
         """
         for attempt in range(self.config.MAX_RETRIES):
             try:
                 return await func(*args, **kwargs)
-            except (APIConnectionError, APITimeoutError) as e:
+            except (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError) as e:
                 if attempt == self.config.MAX_RETRIES - 1:
                     raise e
-                await asyncio.sleep(2 ** attempt)
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    # Full jitter: spreads retries across the whole window so clients don't sync up
+                    delay = backoff_delay(attempt, cap=self.config.MAX_BACKOFF)
+                await asyncio.sleep(min(delay, self.config.MAX_BACKOFF))
             except Exception as e:
                 raise e
 
+    async def _upload_page_image(self, messages: List[dict]) -> None:
+        """
+        PUTs the page image to IMAGE_UPLOAD_URL and points the message at the stored
+        copy, so the request carries a URL instead of inline base64.
+        The inline image is kept if the upload fails.
+        """
+        image_url = messages[0]["content"][1]["image_url"]
+        data = _b64decode(image_url["url"].partition(",")[2])
+        # Renders are PNG (PDF pages) or JPEG (uploaded images) despite the data URI label
+        ext, mime = ("jpg", "image/jpeg") if data.startswith(b"\xff\xd8") else ("png", "image/png")
+        url = f"{self.config.IMAGE_UPLOAD_URL.rstrip('/')}/{hashlib.sha256(data).hexdigest()}.{ext}"
+        try:
+            response = await _get_http_client().put(url, content=data, headers={"Content-Type": mime})
+            response.raise_for_status()
+        except httpx.HTTPError:
+            return
+        image_url["url"] = url
+
     def _resolve_model_name(self, model: Optional[str]) -> str:
         """Resolve model name from request value or environment fallback."""
         candidate = (model or "").strip()
@@ -144,15 +293,6 @@ class TyphoonOCRService:
             return candidate
         return self.config.MODEL_NAME
 
-    @staticmethod
-    def _extract_image_base64(messages: List[dict]) -> str:
-        """Extract preview image (base64) from prepared OCR messages."""
-        try:
-            img_url = messages[0]["content"][1]["image_url"]["url"]
-            return img_url.split(",")[-1] if "," in img_url else ""
-        except Exception:
-            return ""
-
     @staticmethod
     def _parse_response_text(content: Any) -> str:
         """
@@ -167,19 +307,18 @@ class TyphoonOCRService:
 
         def _extract_from_json(candidate: str) -> Optional[str]:
             try:
-                parsed = json.loads(candidate)
+                parsed = _json_loads(candidate)
                 if isinstance(parsed, dict):
                     natural_text = parsed.get("natural_text")
                     if natural_text is not None:
                         return str(natural_text)
-            except (json.JSONDecodeError, TypeError):
+            except (ValueError, TypeError):
                 return None
             return None
 
         parsed_text = _extract_from_json(raw_content)
         if parsed_text is None:
-            fenced_matches = re.findall(r"```(?:json)?\s*(\{[\s\S]*?\})\s*```", raw_content, re.IGNORECASE)
-            for candidate in fenced_matches:
+            for candidate in _FENCED_JSON_RE.findall(raw_content):
                 parsed_text = _extract_from_json(candidate)
                 if parsed_text is not None:
                     break
@@ -187,7 +326,7 @@ class TyphoonOCRService:
         if parsed_text is None:
             parsed_text = raw_content
 
-        return parsed_text.replace("<figure>", "").replace("</figure>", "").strip()
+        return _FIGURE_TAG_RE.sub("", parsed_text).strip()
 
     async def process_single_page(
         self,
@@ -210,17 +349,21 @@ class TyphoonOCRService:
         resolved_model = self._resolve_model_name(model)
 
         try:
-            # File reading and image processing is CPU bound, offload to thread pool
-            messages = await asyncio.to_thread(
-                prepare_ocr_messages,
-                file_path,
-                task_type,
-                self.config.IMAGE_DIM,
-                self.config.TEXT_LENGTH,
-                page_num
+            # Rasterization is CPU bound; render in worker processes to sidestep the GIL
+            render_args = (
+                file_path, task_type, self.config.IMAGE_DIM, self.config.TEXT_LENGTH, page_num,
+                self.config.PREVIEW_FORMAT, self.config.PREVIEW_QUALITY,
             )
+            try:
+                loop = asyncio.get_running_loop()
+                messages, image_base64 = await loop.run_in_executor(_get_render_pool(), _render_page, *render_args)
+            except (BrokenProcessPool, pickle.PicklingError):
+                # Pool died or the callable is not importable by workers; render in a thread instead
+                _reset_render_pool()
+                messages, image_base64 = await asyncio.to_thread(_render_page, *render_args)
 
-            image_base64 = self._extract_image_base64(messages)
+            if self.config.IMAGE_UPLOAD_URL:
+                await self._upload_page_image(messages)
 
             response = await self._call_api_with_retry(
                 self.client.chat.completions.create,
@@ -261,6 +404,56 @@ class TyphoonOCRService:
                 0
             )
 
+    async def _target_pages(self, file_path: str, pages: Optional[List[int]]) -> List[int]:
+        """Resolves requested pages against the document; all pages when none are given."""
+        # get_page_count is fast enough to keep sync, but could be offloaded
+        total_pages = await asyncio.to_thread(self.get_page_count, file_path)
+        if pages:
+            return [p for p in pages if 1 <= p <= total_pages]
+        if file_path.lower().endswith(".pdf"):
+            return list(range(1, total_pages + 1))
+        return [1]
+
+    async def iter_document(
+        self,
+        file_path: str,
+        task_type: str = "default",
+        model: Optional[str] = None,
+        pages: Optional[List[int]] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        top_p: Optional[float] = None,
+        repetition_penalty: Optional[float] = None,
+    ) -> AsyncIterator[Tuple[OcrPageResult, int]]:
+        """
+        Runs page OCR concurrently like `process_document`, but yields each
+        (page result, token count) as soon as it finishes instead of in page order.
+        """
+        target_pages = await self._target_pages(file_path, pages)
+        semaphore = asyncio.Semaphore(self.config.CONCURRENCY)
+
+        async def _process_page(page_num):
+            async with semaphore:
+                return await self.process_single_page(
+                    file_path=file_path,
+                    page_num=page_num,
+                    task_type=task_type,
+                    model=model,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    top_p=top_p,
+                    repetition_penalty=repetition_penalty
+                )
+
+        tasks = [asyncio.create_task(_process_page(p)) for p in target_pages]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Consumer stopped early (e.g. client disconnected); drop the remaining pages
+            for task in tasks:
+                task.cancel()
+
     async def process_document(
         self,
         file_path: str,
@@ -280,21 +473,12 @@ class TyphoonOCRService:
         if not file_path or not os.path.exists(file_path):
             return OcrResult(success=False, error="File not found")
 
-        is_pdf = file_path.lower().endswith(".pdf")
-        # get_page_count is fast enough to keep sync, but could be offloaded
-        total_pages = await asyncio.to_thread(self.get_page_count, file_path)
-
-        if pages:
-            target_pages = [p for p in pages if 1 <= p <= total_pages]
-        elif is_pdf:
-            target_pages = list(range(1, total_pages + 1))
-        else:
-            target_pages = [1]
+        target_pages = await self._target_pages(file_path, pages)
 
         results: List[OcrPageResult] = []
         total_tokens = 0
 
-        semaphore = asyncio.Semaphore(5)
+        semaphore = asyncio.Semaphore(self.config.CONCURRENCY)
 
         async def _process_page(page_num):
             async with semaphore:
@@ -326,6 +510,20 @@ class TyphoonOCRService:
         )
 
 
+async def close_shared_resources() -> None:
+    """
+    Closes the shared HTTP pool and render workers; called on application shutdown.
+    Both are recreated on next use, so a later lifespan starts with fresh ones.
+    """
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+    if _render_pool is not None:
+        _render_pool.shutdown(wait=False, cancel_futures=True)
+        _reset_render_pool()
+
+
 # Singleton instance
 _service_instance: Optional[TyphoonOCRService] = None
 
@@ -0,0 +1,150 @@
+"""
+Shared pytest fixtures for the typhoon-ocr test suite.
+
+Patch targets used by many tests live here, so each test requests a fixture
+instead of stacking `@patch(...)` decorators.
+"""
+import base64
+from unittest.mock import MagicMock, create_autospec
+
+import pytest
+from openai import OpenAI
+from openai.resources.chat import Chat
+from openai.resources.chat.completions import Completions
+from PIL import Image
+
+from typhoon_ocr import ocr_utils
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "unit: fast tests that run entirely against mocks")
+    config.addinivalue_line("markers", "io: tests that reach the real filesystem")
+    config.addinivalue_line("markers", "pdf: tests that exercise the PDF branch of the OCR pipeline")
+    # Registered here too so the marker is known when pytest-xdist is not installed
+    config.addinivalue_line("markers", "xdist_group(name): keep tests on one xdist worker under --dist loadgroup")
+
+
+@pytest.fixture
+def mock_image_open(mocker):
+    """Patches `PIL.Image.open` as seen by `typhoon_ocr.ocr_utils`."""
+    return mocker.patch('typhoon_ocr.ocr_utils.Image.open')
+
+
+@pytest.fixture
+def mock_openai(mocker):
+    """Patches the `OpenAI` client class used by `ocr_document`."""
+    return mocker.patch('typhoon_ocr.ocr_utils.OpenAI')
+
+
+@pytest.fixture(scope="module")
+def openai_client_spec():
+    """An autospec'd `OpenAI` client, built once per module.
+
+    `chat` and `chat.completions` are cached properties, which autospec cannot see
+    through, so they are specced explicitly.
+    """
+    client = create_autospec(OpenAI, instance=True)
+    client.chat = create_autospec(Chat, instance=True)
+    client.chat.completions = create_autospec(Completions, instance=True)
+    return client
+
+
+@pytest.fixture
+def openai_client_mock(openai_client_spec):
+    """The module's autospec'd `OpenAI` client, reset after each test."""
+    yield openai_client_spec
+    openai_client_spec.reset_mock(return_value=True, side_effect=True)
+
+
+@pytest.fixture(scope="class")
+def class_openai(class_mocker):
+    """Patches `OpenAI` once for a whole test class."""
+    return class_mocker.patch('typhoon_ocr.ocr_utils.OpenAI')
+
+
+@pytest.fixture
+def openai_patch(class_openai):
+    """The class-wide `OpenAI` patch, reset so each test starts with no return value or side effect."""
+    class_openai.reset_mock(return_value=True, side_effect=True)
+    return class_openai
+
+
+@pytest.fixture(scope="session")
+def mock_image_factory():
+    """Returns a builder for stand-in PIL images with a given size/mode and extra attributes."""
+    def make(size=(100, 100), mode='RGB', **attrs):
+        img = MagicMock()
+        img.size = size
+        img.mode = mode
+        for name, value in attrs.items():
+            setattr(img, name, value)
+        return img
+    return make
+
+
+@pytest.fixture
+def img_mock():
+    """
+    A `PIL.Image.Image` autospec of this test's own, so attributes a test assigns
+    (e.g. `size`, `mode`) never leak into the next. A spec'd stand-in fails loudly
+    if a test touches an attribute PIL does not have.
+    """
+    return create_autospec(Image.Image, instance=True)
+
+
+@pytest.fixture(scope="session")
+def fake_b64_image():
+    """Base64 of a small placeholder payload, encoded once per session."""
+    return base64.b64encode(b"fake image data").decode()
+
+
+@pytest.fixture(scope="session")
+def library_media_box():
+    """The library's pdfinfo-based `get_pdf_media_box_width_height`."""
+    return ocr_utils.get_pdf_media_box_width_height
+
+
+@pytest.fixture(scope="session")
+def canned_ocr_messages():
+    """Minimal chat messages standing in for `prepare_ocr_messages` output."""
+    return [{"role": "user", "content": [{"type": "text", "text": "test"}]}]
+
+
+@pytest.fixture
+def mock_prepare(mocker, canned_ocr_messages):
+    """Patches `prepare_ocr_messages` to return the canned messages."""
+    return mocker.patch('typhoon_ocr.ocr_utils.prepare_ocr_messages', return_value=canned_ocr_messages)
+
+
+@pytest.fixture
+def in_memory_fs(mocker):
+    """Replaces the library's filesystem seam (`ocr_utils._fs`) so temp files never hit disk."""
+    return mocker.patch('typhoon_ocr.ocr_utils._fs')
+
+
+@pytest.fixture(scope="session")
+def big_b64():
+    """~13 MB base64 string for stress variants; deterministic, so built once per session."""
+    return base64.b64encode(bytes(range(256)) * 40_000).decode()
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    """Makes `time.sleep` and `asyncio.sleep` return immediately, so retry paths never wait."""
+    async def _no_async_sleep(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr('time.sleep', lambda *args, **kwargs: None)
+    monkeypatch.setattr('asyncio.sleep', _no_async_sleep)
+
+
+@pytest.fixture(scope="class")
+def pdf_available(class_mocker):
+    """Reports Poppler as installed for every test in the requesting class."""
+    class_mocker.patch('typhoon_ocr.pdf_utils.pdf_utils_available', True)
+
+
+@pytest.fixture(scope="class")
+def pdf_unavailable(class_mocker):
+    """Reports Poppler as missing for every test in the requesting class."""
+    class_mocker.patch('typhoon_ocr.pdf_utils.pdf_utils_available', False)
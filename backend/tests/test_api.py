@@ -1,8 +1,11 @@
+import asyncio
 import sys
 import shutil
 from pathlib import Path
+import httpx
+import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from uuid import uuid4
 
 # Add backend to path
@@ -118,3 +121,172 @@ def test_ocr_endpoint_accepts_v15_task_type(mock_get_service):
     called_kwargs = mock_service_instance.process_document.call_args.kwargs
     assert called_kwargs["task_type"] == "v1.5"
     assert called_kwargs["model"] == "typhoon-ocr"
+
+
+@patch("routes.ocr.get_ocr_service")
+def test_ocr_endpoint_gzips_large_responses(mock_get_service):
+    """Test large OCR responses are gzip-compressed for clients that accept it."""
+    from services.ocr_service import OcrResult, OcrPageResult
+
+    long_text = "ข้อความทดสอบ " * 500
+    mock_service_instance = MagicMock()
+    mock_service_instance.process_document = AsyncMock(return_value=OcrResult(
+        success=True,
+        results=[
+            OcrPageResult(page=1, success=True, text=long_text, image_base64="", error=None)
+        ],
+        total_tokens=100,
+        processing_time=1.0,
+        error=None
+    ))
+    mock_get_service.return_value = mock_service_instance
+
+    files = {'file': ('test.pdf', b'dummy content', 'application/pdf')}
+    data = {'model': 'typhoon-ocr', 'task_type': 'default'}
+
+    temp_dir = _make_workspace_tmp_dir()
+    try:
+        with patch("routes.ocr.tempfile.mkdtemp", return_value=temp_dir):
+            response = client.post(
+                "/api/ocr", files=files, data=data, headers={"Accept-Encoding": "gzip"}
+            )
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    assert response.status_code == 200, f"Response: {response.text}"
+    assert response.headers.get("content-encoding") == "gzip"
+    assert response.json()["results"][0]["text"] == long_text
+
+
+def test_page_count_endpoint_reads_pdf_in_memory():
+    """Test page counting parses the upload without spooling it to a temp dir."""
+    from io import BytesIO
+    from pypdf import PdfWriter
+    from services.ocr_service import Config, TyphoonOCRService
+
+    writer = PdfWriter()
+    for _ in range(3):
+        writer.add_blank_page(width=200, height=200)
+    pdf_bytes = BytesIO()
+    writer.write(pdf_bytes)
+
+    files = {'file': ('test.pdf', pdf_bytes.getvalue(), 'application/pdf')}
+    service = TyphoonOCRService(Config(API_KEY="test-key"))
+    with patch("routes.ocr.get_ocr_service", return_value=service), \
+            patch("routes.ocr.tempfile.mkdtemp") as mock_mkdtemp:
+        response = client.request("GET", "/api/page-count", files=files)
+
+    assert response.status_code == 200, f"Response: {response.text}"
+    assert response.json() == {"page_count": 3, "is_pdf": True}
+    mock_mkdtemp.assert_not_called()
+
+
+def test_parse_pages_merges_overlapping_ranges():
+    """Test page specs expand to sorted unique pages and reject malformed parts."""
+    import pytest
+    from routes.ocr import _parse_pages
+
+    assert _parse_pages("5, 1-3,2-4,,9-7") == [1, 2, 3, 4, 5, 7, 8, 9]
+    assert _parse_pages("3") == [3]
+    with pytest.raises(ValueError):
+        _parse_pages("1-a")
+    with pytest.raises(ValueError):
+        _parse_pages("-3")
+
+
+@patch("routes.ocr.get_ocr_service")
+def test_ocr_endpoint_streams_ndjson(mock_get_service):
+    """Test ?stream=true returns one JSON line per finished page plus a summary line."""
+    import json
+    from services.ocr_service import OcrPageResult
+
+    async def iter_document(**kwargs):
+        yield OcrPageResult(page=2, success=True, text="second"), 7
+        yield OcrPageResult(page=1, success=False, error="boom"), 0
+
+    mock_service_instance = MagicMock()
+    mock_service_instance.iter_document = iter_document
+    mock_get_service.return_value = mock_service_instance
+
+    files = {'file': ('test.pdf', b'dummy content', 'application/pdf')}
+    temp_dir = _make_workspace_tmp_dir()
+    with patch("routes.ocr.tempfile.mkdtemp", return_value=temp_dir):
+        response = client.post("/api/ocr?stream=true", files=files, data={'task_type': 'default'})
+
+    assert response.status_code == 200, f"Response: {response.text}"
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["type"] for line in lines] == ["page", "page", "complete"]
+    assert lines[0]["page"] == 2 and lines[0]["text"] == "second"
+    assert lines[2]["success"] is False
+    assert lines[2]["total_tokens"] == 7
+    assert not Path(temp_dir).exists()
+
+
+@patch("routes.ocr.get_ocr_service")
+def test_ocr_ndjson_stream_is_not_gzipped(mock_get_service):
+    """Test ?stream=true stays uncompressed even when the client accepts gzip."""
+    from services.ocr_service import OcrPageResult
+
+    async def iter_document(**kwargs):
+        yield OcrPageResult(page=1, success=True, text="ข้อความทดสอบ " * 500), 7
+
+    mock_service_instance = MagicMock()
+    mock_service_instance.iter_document = iter_document
+    mock_get_service.return_value = mock_service_instance
+
+    files = {'file': ('test.pdf', b'dummy content', 'application/pdf')}
+    temp_dir = _make_workspace_tmp_dir()
+    with patch("routes.ocr.tempfile.mkdtemp", return_value=temp_dir):
+        response = client.post(
+            "/api/ocr?stream=true", files=files, data={'task_type': 'default'},
+            headers={"Accept-Encoding": "gzip"},
+        )
+
+    assert response.status_code == 200, f"Response: {response.text}"
+    assert "content-encoding" not in response.headers
+    assert len(response.text.splitlines()) == 2
+
+
+def test_stream_requests_bypass_gzip():
+    """Test which requests the gzip middleware treats as streams."""
+    from main import _is_stream_request
+
+    def scope(path, query=b""):
+        return {"type": "http", "path": path, "query_string": query}
+
+    assert _is_stream_request(scope("/api/ocr/stream"))
+    assert _is_stream_request(scope("/api/ocr", b"stream=true"))
+    assert _is_stream_request(scope("/api/ocr", b"stream=1"))
+    assert not _is_stream_request(scope("/api/ocr", b"stream=false"))
+    assert not _is_stream_request(scope("/api/ocr"))
+    assert not _is_stream_request(scope("/api/models"))
+
+
+def test_service_client_survives_lifespan_restart():
+    """Test a second app lifespan gets a fresh HTTP pool instead of the closed one."""
+    from services.ocr_service import Config, TyphoonOCRService
+
+    service = TyphoonOCRService(Config(API_KEY="test-key"))
+    with TestClient(app):
+        first = service.client
+    assert first._client.is_closed
+
+    with TestClient(app):
+        second = service.client
+        assert second is not first
+        assert not second._client.is_closed
+
+
+@pytest.mark.usefixtures("no_sleep")
+def test_service_retries_transient_api_errors():
+    """Test the service retries a dropped connection instead of failing the page."""
+    from openai import APIConnectionError
+    from services.ocr_service import Config, TyphoonOCRService
+
+    service = TyphoonOCRService(Config(API_KEY="test-key"))
+    dropped = APIConnectionError(request=httpx.Request("POST", "http://upstream.test/v1/chat/completions"))
+    call = AsyncMock(side_effect=[dropped, "completion"])
+
+    assert asyncio.run(service._call_api_with_retry(call, model="typhoon-ocr")) == "completion"
+    assert call.await_count == 2
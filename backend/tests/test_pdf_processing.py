@@ -12,14 +12,25 @@ import subprocess
 from PIL import Image
 import base64
 import io
+import dataclasses
+import functools
+import random
+import re
+from types import SimpleNamespace
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import RectangleObject
 
 # Import the functions to test
 from typhoon_ocr.ocr_utils import (
     image_to_pdf,
-    get_pdf_media_box_width_height,
     render_pdf_to_base64png,
+    get_anchor_text,
     _pdf_report,
     _linearize_pdf_report,
+    _merge_image_elements,
+    _cleanup_element_text,
+    clear_pdf_cache,
 )
 from typhoon_ocr.pdf_utils import check_pdf_utilities
 from typhoon_ocr.pdf_utils import pdf_utils_available
@@ -30,58 +41,109 @@ from typhoon_ocr.ocr_utils import (
     PageReport,
 )
 
+@functools.lru_cache(maxsize=None)
+def _all_of(needles):
+    """Compiles one pattern that matches only when every needle appears in the text, in any order."""
+    return re.compile('(?s)' + ''.join(f'(?=.*{re.escape(needle)})' for needle in needles))
+
+
+def _assert_all_in(text, *needles):
+    """Asserts every needle occurs in `text` with one precompiled match, listing any that are missing."""
+    assert _all_of(needles).match(text), [needle for needle in needles if needle not in text]
+
+
+# What the fake pdftoppm "renders", and the base64 text render_pdf_to_base64png should return for it
+_PNG_HEADER = b'\x89PNG\r\n\x1a\n'
+_PNG_HEADER_B64 = base64.b64encode(_PNG_HEADER).decode('ascii')
+
+# pdfinfo argv for /test/file.pdf, pages 1 and 5
+_PDFINFO_ARGV_P1 = ["pdfinfo", "-f", "1", "-l", "1", "-box", "-enc", "UTF-8", "/test/file.pdf"]
+_PDFINFO_ARGV_P5 = ["pdfinfo", "-f", "5", "-l", "5", "-box", "-enc", "UTF-8", "/test/file.pdf"]
+
+# US Letter MediaBox shared by the linearization fixtures
+_LETTER = BoundingBox(0, 0, 612, 792)
+
+
+@pytest.fixture
+def fake_run(monkeypatch):
+    """Replaces `subprocess.run` in ocr_utils with a stub; tests set `result` and read the argv `calls`."""
+    run = SimpleNamespace(result=None, calls=[])
+
+    def _run(args, **kwargs):
+        run.calls.append(args)
+        return run.result
+
+    monkeypatch.setattr('typhoon_ocr.ocr_utils.subprocess.run', _run)
+    return run
+
+
+@pytest.fixture
+def poppler_tools(monkeypatch):
+    """Fakes `shutil.which` for the Poppler tools; tests add names to `missing`, `warn` records warnings."""
+    tools = SimpleNamespace(missing=set(), warn=MagicMock())
+    monkeypatch.setattr(
+        'typhoon_ocr.pdf_utils.shutil.which',
+        lambda cmd: None if cmd in tools.missing else '/usr/bin/' + cmd,
+    )
+    monkeypatch.setattr('typhoon_ocr.pdf_utils.warnings.warn', tools.warn)
+    return tools
+
 
 class TestPdfUtilities:
     """Test PDF utility availability checking."""
 
-    @patch('typhoon_ocr.pdf_utils.shutil.which')
-    @patch('typhoon_ocr.pdf_utils.warnings.warn')
-    def test_all_utilities_available(self, mock_warn, mock_which):
-        """Test when all PDF utilities are available."""
-        mock_which.side_effect = lambda cmd: '/usr/bin/' + cmd  # Simulate found utilities
+    @pytest.mark.parametrize("missing, expected", [
+        (set(), True),
+        ({'pdfinfo'}, False),
+        ({'pdftoppm'}, False),
+        ({'pdfinfo', 'pdftoppm'}, False),
+    ], ids=["all_available", "missing_pdfinfo", "missing_pdftoppm", "all_missing"])
+    def test_check_pdf_utilities(self, poppler_tools, missing, expected):
+        """Test availability checking and the warning for each combination of missing tools."""
+        poppler_tools.missing = missing
         
         result = check_pdf_utilities()
         
-        assert result is True
-        mock_warn.assert_not_called()
+        assert result is expected
+        if not missing:
+            poppler_tools.warn.assert_not_called()
+            return
+        poppler_tools.warn.assert_called_once()
+        warning_message = str(poppler_tools.warn.call_args[0][0])
+        listed = ", ".join(tool for tool in ("pdfinfo", "pdftoppm") if tool in missing)
+        assert f"missing: {listed}." in warning_message
 
-    @patch('typhoon_ocr.pdf_utils.shutil.which')
-    @patch('typhoon_ocr.pdf_utils.warnings.warn')
-    def test_missing_pdfinfo_only(self, mock_warn, mock_which):
-        """Test when only pdfinfo is missing."""
-        mock_which.side_effect = lambda cmd: '/usr/bin/' + cmd if cmd == 'pdftoppm' else None
-        
-        result = check_pdf_utilities()
-        
-        assert result is False
-        mock_warn.assert_called_once()
-        assert "pdfinfo" in str(mock_warn.call_args)
 
-    @patch('typhoon_ocr.pdf_utils.shutil.which')
-    @patch('typhoon_ocr.pdf_utils.warnings.warn')
-    def test_missing_pdftoppm_only(self, mock_warn, mock_which):
-        """Test when only pdftoppm is missing."""
-        mock_which.side_effect = lambda cmd: '/usr/bin/' + cmd if cmd == 'pdfinfo' else None
-        
-        result = check_pdf_utilities()
-        
-        assert result is False
-        mock_warn.assert_called_once()
-        assert "pdftoppm" in str(mock_warn.call_args)
+class _FakeTemp:
+    """Stands in for `NamedTemporaryFile(delete=False)`: a context manager with a `name`."""
 
-    @patch('typhoon_ocr.pdf_utils.shutil.which')
-    @patch('typhoon_ocr.pdf_utils.warnings.warn')
-    def test_all_utilities_missing(self, mock_warn, mock_which):
-        """Test when both utilities are missing."""
-        mock_which.return_value = None
-        
-        result = check_pdf_utilities()
-        
-        assert result is False
-        mock_warn.assert_called_once()
-        warning_message = str(mock_warn.call_args[0][0])
-        assert "pdfinfo" in warning_message
-        assert "pdftoppm" in warning_message
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _FakeImage:
+    """Minimal PIL image stand-in that records `convert`/`save` calls."""
+
+    def __init__(self, mode='RGB', save_error=None):
+        self.mode = mode
+        self.converted = []
+        self.saved = []
+        self._save_error = save_error
+
+    def convert(self, mode):
+        self.converted.append(mode)
+        return self
+
+    def save(self, *args):
+        if self._save_error is not None:
+            raise self._save_error
+        self.saved.append(args)
 
 
 class TestImageToPdf:
@@ -92,20 +154,17 @@ class TestImageToPdf:
     def test_successful_rgb_image_conversion(self, mock_temp_file, mock_image_open):
         """Test successful conversion of RGB image to PDF."""
         # Setup mocks
-        mock_img = MagicMock()
-        mock_img.mode = 'RGB'
-        mock_image_open.return_value = mock_img
-        
-        mock_temp = MagicMock()
-        mock_temp.name = '/tmp/temp_file.pdf'
-        mock_temp_file.return_value.__enter__.return_value = mock_temp
+        img = _FakeImage('RGB')
+        mock_image_open.return_value = img
+        mock_temp_file.return_value = _FakeTemp('/tmp/temp_file.pdf')
         
         # Test
         result = image_to_pdf('/path/to/image.jpg')
         
         # Verify
         mock_image_open.assert_called_once_with('/path/to/image.jpg')
-        mock_img.save.assert_called_once_with(mock_temp.name, "PDF")
+        assert img.converted == []
+        assert img.saved == [('/tmp/temp_file.pdf', "PDF")]
         assert result == '/tmp/temp_file.pdf'
 
     @patch('typhoon_ocr.ocr_utils.Image.open')
@@ -113,21 +172,16 @@ class TestImageToPdf:
     def test_rgba_image_conversion(self, mock_temp_file, mock_image_open):
         """Test conversion of RGBA image to PDF."""
         # Setup mocks
-        mock_img = MagicMock()
-        mock_img.mode = 'RGBA'
-        mock_img.convert.return_value = mock_img  # Returns self after conversion
-        mock_image_open.return_value = mock_img
-        
-        mock_temp = MagicMock()
-        mock_temp.name = '/tmp/temp_file.pdf'
-        mock_temp_file.return_value.__enter__.return_value = mock_temp
+        img = _FakeImage('RGBA')  # convert() returns itself
+        mock_image_open.return_value = img
+        mock_temp_file.return_value = _FakeTemp('/tmp/temp_file.pdf')
         
         # Test
         result = image_to_pdf('/path/to/rgba_image.png')
         
         # Verify
-        mock_img.convert.assert_called_once_with('RGB')
-        mock_img.save.assert_called_once_with(mock_temp.name, "PDF")
+        assert img.converted == ['RGB']
+        assert img.saved == [('/tmp/temp_file.pdf', "PDF")]
         assert result == '/tmp/temp_file.pdf'
 
     @patch('typhoon_ocr.ocr_utils.Image.open')
@@ -144,10 +198,8 @@ class TestImageToPdf:
     def test_save_failure(self, mock_temp_file, mock_image_open):
         """Test handling of PDF save failure."""
         # Setup mocks
-        mock_img = MagicMock()
-        mock_img.mode = 'RGB'
-        mock_img.save.side_effect = Exception("Save failed")
-        mock_image_open.return_value = mock_img
+        mock_image_open.return_value = _FakeImage('RGB', save_error=Exception("Save failed"))
+        mock_temp_file.return_value = _FakeTemp('/tmp/temp_file.pdf')
         
         # Test
         result = image_to_pdf('/path/to/image.jpg')
@@ -155,103 +207,112 @@ class TestImageToPdf:
         assert result is None
 
 
+@pytest.mark.usefixtures("pdf_available")
 class TestGetPdfMediaBoxWidthHeight:
     """Test PDF MediaBox dimension extraction."""
 
-    @patch('typhoon_ocr.pdf_utils.pdf_utils_available', False)
-    def test_pdf_utilities_not_available(self):
+    @patch('typhoon_ocr.pdf_utils.pdf_utils_available', False)  # overrides the class-wide True
+    def test_pdf_utilities_not_available(self, library_media_box):
         """Test error when PDF utilities are not available."""
         with pytest.raises(ImportError) as exc_info:
-            get_pdf_media_box_width_height('/test/file.pdf', 1)
+            library_media_box('/test/file.pdf', 1)
         
         assert "PDF utilities are not available" in str(exc_info.value)
         assert "brew install poppler" in str(exc_info.value)
 
-    @patch('typhoon_ocr.pdf_utils.pdf_utils_available', True)
-    @patch('typhoon_ocr.ocr_utils.subprocess.run')
-    def test_subprocess_failure(self, mock_subprocess):
+    def test_subprocess_failure(self, library_media_box, fake_run):
         """Test handling of subprocess failure."""
-        mock_subprocess.return_value = MagicMock(
+        fake_run.result = SimpleNamespace(
             returncode=1,
-            stderr="pdfinfo: command failed"
+            stderr="pdfinfo: command failed",
+            stdout=""
         )
         
         with pytest.raises(ValueError) as exc_info:
-            get_pdf_media_box_width_height('/test/file.pdf', 1)
+            library_media_box('/test/file.pdf', 1)
         
         assert "Error running pdfinfo" in str(exc_info.value)
         assert "command failed" in str(exc_info.value)
 
-    @patch('typhoon_ocr.pdf_utils.pdf_utils_available', True)
-    @patch('typhoon_ocr.ocr_utils.subprocess.run')
-    def test_no_mediabox_in_output(self, mock_subprocess):
+    def test_no_mediabox_in_output(self, library_media_box, fake_run):
         """Test when MediaBox is not found in pdfinfo output."""
-        mock_subprocess.return_value = MagicMock(
+        fake_run.result = SimpleNamespace(
             returncode=0,
-            stdout="Title: Test PDF\nAuthor: Test\nPages: 1\n"
+            stdout="Title: Test PDF\nAuthor: Test\nPages: 1\n",
+            stderr=""
         )
         
         with pytest.raises(ValueError) as exc_info:
-            get_pdf_media_box_width_height('/test/file.pdf', 1)
+            library_media_box('/test/file.pdf', 1)
         
         assert "MediaBox not found" in str(exc_info.value)
 
-    @patch('typhoon_ocr.pdf_utils.pdf_utils_available', True)
-    @patch('typhoon_ocr.ocr_utils.subprocess.run')
-    def test_successful_mediabox_extraction(self, mock_subprocess):
+    def test_successful_mediabox_extraction(self, library_media_box, fake_run):
         """Test successful MediaBox extraction."""
-        mock_subprocess.return_value = MagicMock(
+        fake_run.result = SimpleNamespace(
             returncode=0,
-            stdout="Title: Test PDF\nMediaBox: 0 0 612 792\nPages: 1\n"
+            stdout="Title: Test PDF\nMediaBox: 0 0 612 792\nPages: 1\n",
+            stderr=""
         )
         
-        result = get_pdf_media_box_width_height('/test/file.pdf', 1)
+        result = library_media_box('/test/file.pdf', 1)
         
         assert result == (612.0, 792.0)
-        mock_subprocess.assert_called_once()
-        call_args = mock_subprocess.call_args[0][0]
-        assert call_args == ["pdfinfo", "-f", "1", "-l", "1", "-box", "-enc", "UTF-8", "/test/file.pdf"]
+        assert len(fake_run.calls) == 1
+        call_args = fake_run.calls[-1]
+        assert call_args == _PDFINFO_ARGV_P1
 
-    @patch('typhoon_ocr.pdf_utils.pdf_utils_available', True)
-    @patch('typhoon_ocr.ocr_utils.subprocess.run')
-    def test_mediabox_with_negative_coordinates(self, mock_subprocess):
+    def test_mediabox_with_negative_coordinates(self, library_media_box, fake_run):
         """Test MediaBox with negative coordinates."""
-        mock_subprocess.return_value = MagicMock(
+        fake_run.result = SimpleNamespace(
             returncode=0,
-            stdout="MediaBox: -50 -100 562 692\n"
+            stdout="MediaBox: -50 -100 562 692\n",
+            stderr=""
         )
         
-        result = get_pdf_media_box_width_height('/test/file.pdf', 1)
+        result = library_media_box('/test/file.pdf', 1)
         
         # Should calculate absolute differences
         assert result == (612.0, 792.0)
 
-    @patch('typhoon_ocr.pdf_utils.pdf_utils_available', True)
-    @patch('typhoon_ocr.ocr_utils.subprocess.run')
-    def test_different_page_numbers(self, mock_subprocess):
+    def test_different_page_numbers(self, library_media_box, fake_run):
         """Test with different page numbers."""
-        mock_subprocess.return_value = MagicMock(
+        fake_run.result = SimpleNamespace(
             returncode=0,
-            stdout="MediaBox: 0 0 400 600\n"
+            stdout="MediaBox: 0 0 400 600\n",
+            stderr=""
         )
         
         # Test page 5
-        result = get_pdf_media_box_width_height('/test/file.pdf', 5)
+        result = library_media_box('/test/file.pdf', 5)
         
         assert result == (400.0, 600.0)
-        call_args = mock_subprocess.call_args[0][0]
-        # The actual command structure is: ["pdfinfo", "-f", "5", "-l", "5", "-box", "-enc", "UTF-8", "/test/file.pdf"]
-        assert call_args[0] == "pdfinfo"
-        assert call_args[1] == "-f"  # From page
-        assert call_args[2] == "5"
-        assert call_args[3] == "-l"  # To page
-        assert call_args[4] == "5"
+        call_args = fake_run.calls[-1]
+        assert call_args == _PDFINFO_ARGV_P5
+
+    @pytest.mark.io
+    def test_result_cached_per_file_version(self, library_media_box, fake_run, tmp_path):
+        """Test that pdfinfo runs once per page of an unchanged file, and again once the file changes."""
+        pdf = tmp_path / "doc.pdf"
+        pdf.write_bytes(b"%PDF-1.4")
+        fake_run.result = SimpleNamespace(returncode=0, stdout="MediaBox: 0 0 612 792\n", stderr="")
+        clear_pdf_cache()
+        
+        assert library_media_box(str(pdf), 1) == library_media_box(str(pdf), 1) == (612.0, 792.0)
+        assert len(fake_run.calls) == 1
+        
+        library_media_box(str(pdf), 2)
+        pdf.write_bytes(b"%PDF-1.4 rewritten")
+        library_media_box(str(pdf), 1)
+        assert len(fake_run.calls) == 3
+        clear_pdf_cache()
 
 
+@pytest.mark.usefixtures("pdf_available")
 class TestRenderPdfToBase64Png:
     """Test PDF to PNG rendering functionality."""
 
-    @patch('typhoon_ocr.pdf_utils.pdf_utils_available', False)
+    @patch('typhoon_ocr.pdf_utils.pdf_utils_available', False)  # overrides the class-wide True
     def test_pdf_utilities_not_available(self):
         """Test error when PDF utilities are not available."""
         with pytest.raises(ImportError) as exc_info:
@@ -259,42 +320,94 @@ class TestRenderPdfToBase64Png:
         
         assert "PDF utilities are not available" in str(exc_info.value)
 
-    @patch('typhoon_ocr.pdf_utils.pdf_utils_available', True)
     @patch('typhoon_ocr.ocr_utils.get_pdf_media_box_width_height')
-    @patch('typhoon_ocr.ocr_utils.subprocess.run')
-    def test_successful_rendering(self, mock_subprocess, mock_dimensions):
+    def test_successful_rendering(self, mock_dimensions, fake_run):
         """Test successful PDF to PNG rendering."""
         mock_dimensions.return_value = (612.0, 792.0)
-        mock_subprocess.return_value = MagicMock(
+        fake_run.result = SimpleNamespace(
             returncode=0,
-            stdout=b'\x89PNG\r\n\x1a\n'  # PNG header
+            stdout=_PNG_HEADER,
+            stderr=b''
         )
         
         result = render_pdf_to_base64png('/test/file.pdf', 1, target_longest_image_dim=2048)
         
-        assert isinstance(result, str)
-        # Should be valid base64
-        decoded = base64.b64decode(result)
-        assert decoded.startswith(b'\x89PNG')
+        assert result == _PNG_HEADER_B64
         
         # Verify subprocess call
-        call_args = mock_subprocess.call_args[0][0]
-        assert call_args[0] == "pdftoppm"
-        assert call_args[1] == "-png"
-        assert call_args[2] == "-f"
-        assert call_args[3] == "1"
-        assert call_args[4] == "-l"
-        assert call_args[5] == "1"
-
-    @patch('typhoon_ocr.pdf_utils.pdf_utils_available', True)
+        call_args = fake_run.calls[-1]
+        assert call_args[:6] == ["pdftoppm", "-png", "-f", "1", "-l", "1"]
+
+    @pytest.mark.io
     @patch('typhoon_ocr.ocr_utils.get_pdf_media_box_width_height')
-    @patch('typhoon_ocr.ocr_utils.subprocess.run')
-    def test_subprocess_failure(self, mock_subprocess, mock_dimensions):
+    def test_media_box_read_with_pypdf(self, mock_dimensions, fake_run, tmp_path):
+        """Test that a PDF pypdf can parse is sized without running pdfinfo."""
+        pdf = tmp_path / "page.pdf"
+        writer = PdfWriter()
+        writer.add_blank_page(width=300, height=400)
+        writer.write(str(pdf))
+        fake_run.result = SimpleNamespace(returncode=0, stdout=_PNG_HEADER, stderr=b'')
+        
+        render_pdf_to_base64png(str(pdf), 1, target_longest_image_dim=2048)
+        
+        mock_dimensions.assert_not_called()
+        assert [call[0] for call in fake_run.calls] == ["pdftoppm"]
+        assert fake_run.calls[-1][6:8] == ["-r", str(2048 * 72 / 400)]
+        clear_pdf_cache()
+
+    @pytest.mark.io
+    def test_inverted_media_box_sized_positive(self, fake_run, tmp_path):
+        """Test that a MediaBox given upper-right corner first still yields a positive render resolution."""
+        pdf = tmp_path / "inverted.pdf"
+        writer = PdfWriter()
+        writer.add_blank_page(width=300, height=400).mediabox = RectangleObject([300, 400, 0, 0])
+        writer.write(str(pdf))
+        fake_run.result = SimpleNamespace(returncode=0, stdout=_PNG_HEADER, stderr=b'')
+        
+        render_pdf_to_base64png(str(pdf), 1, target_longest_image_dim=2048)
+        
+        assert fake_run.calls[-1][6:8] == ["-r", str(2048 * 72 / 400)]
+        clear_pdf_cache()
+
+    @pytest.mark.io
+    def test_pages_share_one_parse(self, mocker, fake_run, tmp_path):
+        """Test that rendering every page of a document and reading its anchor text parses the PDF only once."""
+        pdf = tmp_path / "pages.pdf"
+        writer = PdfWriter()
+        for _ in range(3):
+            writer.add_blank_page(width=300, height=400)
+        writer.write(str(pdf))
+        fake_run.result = SimpleNamespace(returncode=0, stdout=_PNG_HEADER, stderr=b'')
+        reader = mocker.patch('typhoon_ocr.ocr_utils.PdfReader', wraps=PdfReader)
+        clear_pdf_cache()
+        
+        for page_num in (1, 2, 3):
+            render_pdf_to_base64png(str(pdf), page_num)
+            get_anchor_text(str(pdf), page_num, pdf_engine="pdfreport")
+        
+        reader.assert_called_once_with(str(pdf))
+        assert len(fake_run.calls) == 3
+        clear_pdf_cache()
+
+    @patch('typhoon_ocr.ocr_utils.get_pdf_media_box_width_height')
+    def test_jpeg_rendering(self, mock_dimensions, fake_run):
+        """Test that JPEG output asks pdftoppm for a quality-90 JPEG."""
+        mock_dimensions.return_value = (612.0, 792.0)
+        fake_run.result = SimpleNamespace(returncode=0, stdout=b'\xff\xd8\xff', stderr=b'')
+        
+        result = render_pdf_to_base64png('/test/file.pdf', 1, image_format="jpeg")
+        
+        assert result == base64.b64encode(b'\xff\xd8\xff').decode('ascii')
+        assert fake_run.calls[-1][:8] == ["pdftoppm", "-jpeg", "-jpegopt", "quality=90", "-f", "1", "-l", "1"]
+
+    @patch('typhoon_ocr.ocr_utils.get_pdf_media_box_width_height')
+    def test_subprocess_failure(self, mock_dimensions, fake_run):
         """Test handling of pdftoppm failure."""
         mock_dimensions.return_value = (612.0, 792.0)
-        mock_subprocess.return_value = MagicMock(
+        fake_run.result = SimpleNamespace(
             returncode=1,
-            stderr="pdftoppm: command failed"
+            stderr="pdftoppm: command failed",
+            stdout=b''
         )
         
         with pytest.raises(AssertionError) as exc_info:
@@ -302,40 +415,65 @@ class TestRenderPdfToBase64Png:
         
         assert "command failed" in str(exc_info.value)
 
-    @patch('typhoon_ocr.pdf_utils.pdf_utils_available', True)
     @patch('typhoon_ocr.ocr_utils.get_pdf_media_box_width_height')
-    @patch('typhoon_ocr.ocr_utils.subprocess.run')
-    def test_custom_target_dimension(self, mock_subprocess, mock_dimensions):
+    def test_custom_target_dimension(self, mock_dimensions, fake_run):
         """Test with custom target dimension."""
         mock_dimensions.return_value = (1000.0, 500.0)  # Wide image
-        mock_subprocess.return_value = MagicMock(
+        fake_run.result = SimpleNamespace(
             returncode=0,
-            stdout=b'\x89PNG\r\n\x1a\n'
+            stdout=_PNG_HEADER,
+            stderr=b''
         )
         
         result = render_pdf_to_base64png('/test/file.pdf', 1, target_longest_image_dim=1500)
         
         # Verify resolution calculation
-        call_args = mock_subprocess.call_args[0][0]
+        call_args = fake_run.calls[-1]
         # Should calculate resolution based on target dimension
         resolution_arg = call_args[8]  # -r argument
         assert isinstance(resolution_arg, str)
 
 
+@pytest.fixture
+def pdf_reader_stub(monkeypatch):
+    """Makes `PdfReader` open a one-page document and returns that page (US Letter MediaBox)."""
+    page = MagicMock()
+    page.mediabox = [0, 0, 612, 792]
+    reader = SimpleNamespace(pages=[page])
+    monkeypatch.setattr('typhoon_ocr.ocr_utils.PdfReader', lambda *args, **kwargs: reader)
+    return page
+
+
+def _visit_text(visitor_text=None, visitor_operand_before=None):
+    """`page.extract_text` stand-in that reports "Hello World" at (100, 200)."""
+    # Simulate visitor_text being called with proper transformation matrix
+    if visitor_text:
+        # Identity transformation matrix
+        tm = [1, 0, 0, 1, 100, 200]
+        cm = [1, 0, 0, 1, 0, 0]  # Identity matrix
+        visitor_text("Hello World", tm, cm, None, 12)
+
+
+def _visit_image(visitor_text=None, visitor_operand_before=None):
+    """`page.extract_text` stand-in that draws XObject /Im1 at (50, 100)."""
+    # Simulate visitor_operand_before being called for image
+    if visitor_operand_before:
+        tm = [1, 0, 0, 1, 50, 100]
+        cm = [1, 0, 0, 1, 0, 0]
+        visitor_operand_before(b"Do", [b"Im1"], tm, cm)
+
+
+def _visit_scaled_text(visitor_text=None, visitor_operand_before=None):
+    """`page.extract_text` stand-in that reports "Scaled" at text-space (5, 7) under a 2x CTM offset by (10, 20)."""
+    if visitor_text:
+        visitor_text("Scaled", [2, 0, 0, 2, 10, 20], [1, 0, 0, 1, 5, 7], None, 12)
+
+
 class TestPdfReport:
     """Test PDF report generation functionality."""
 
-    @patch('typhoon_ocr.ocr_utils.PdfReader')
-    def test_successful_pdf_report_generation(self, mock_pdf_reader):
+    def test_successful_pdf_report_generation(self, pdf_reader_stub):
         """Test successful PDF report generation."""
-        # Setup mocks
-        mock_page = MagicMock()
-        mock_page.mediabox = [0, 0, 612, 792]
-        
-        mock_reader = MagicMock()
-        mock_reader.pages = [mock_page]  # Single page
-        mock_pdf_reader.return_value = mock_reader
-        
         result = _pdf_report('/test/file.pdf', 1)
         
         assert isinstance(result, PageReport)
@@ -346,26 +484,9 @@ class TestPdfReport:
         assert isinstance(result.text_elements, list)
         assert isinstance(result.image_elements, list)
 
-    @patch('typhoon_ocr.ocr_utils.PdfReader')
-    def test_extract_text_visitor_function(self, mock_pdf_reader):
+    def test_extract_text_visitor_function(self, pdf_reader_stub):
         """Test that text extraction visitor function works."""
-        # Setup mocks
-        mock_page = MagicMock()
-        mock_page.mediabox = [0, 0, 612, 792]
-        
-        def mock_extract_text(visitor_text=None, visitor_operand_before=None):
-            # Simulate visitor_text being called with proper transformation matrix
-            if visitor_text:
-                # Identity transformation matrix
-                tm = [1, 0, 0, 1, 100, 200]
-                cm = [1, 0, 0, 1, 0, 0]  # Identity matrix
-                visitor_text("Hello World", tm, cm, None, 12)
-        
-        mock_page.extract_text = mock_extract_text
-        
-        mock_reader = MagicMock()
-        mock_reader.pages = [mock_page]
-        mock_pdf_reader.return_value = mock_reader
+        pdf_reader_stub.extract_text = _visit_text
         
         result = _pdf_report('/test/file.pdf', 1)
         
@@ -376,29 +497,21 @@ class TestPdfReport:
         assert text_element.x == 100
         assert text_element.y == 200
 
-    @patch('typhoon_ocr.ocr_utils.PdfReader')
-    def test_extract_image_visitor_function(self, mock_pdf_reader):
-        """Test that image extraction visitor function works."""
-        # Setup mocks
-        mock_page = MagicMock()
-        mock_page.mediabox = [0, 0, 612, 792]
+    def test_text_position_in_user_space(self, pdf_reader_stub):
+        """Test that text positions combine the text matrix with the CTM."""
+        pdf_reader_stub.extract_text = _visit_scaled_text
         
-        def mock_extract_text(visitor_text=None, visitor_operand_before=None):
-            # Simulate visitor_operand_before being called for image
-            if visitor_operand_before:
-                tm = [1, 0, 0, 1, 50, 100]
-                cm = [1, 0, 0, 1, 0, 0]
-                visitor_operand_before(b"Do", [b"Im1"], tm, cm)
+        result = _pdf_report('/test/file.pdf', 1)
         
-        mock_page.extract_text = mock_extract_text
+        assert result.text_elements == [TextElement("Scaled", 20, 34)]
+
+    def test_extract_image_visitor_function(self, pdf_reader_stub):
+        """Test that image extraction visitor function works."""
+        pdf_reader_stub.extract_text = _visit_image
         
         # Mock resources with XObject containing image
         mock_xobject = {b"Im1": {b"/Subtype": b"/Image", b"/Width": 100, b"/Height": 150}}
-        mock_page.get.return_value = mock_xobject
-        
-        mock_reader = MagicMock()
-        mock_reader.pages = [mock_page]
-        mock_pdf_reader.return_value = mock_reader
+        pdf_reader_stub.get.return_value = mock_xobject
         
         result = _pdf_report('/test/file.pdf', 1)
         
@@ -408,155 +521,241 @@ class TestPdfReport:
         # The image extraction might not work with our simplified mock, but the structure should be correct
 
 
+@pytest.fixture(scope="module")
+def empty_report():
+    """A US Letter page with no elements."""
+    return PageReport(mediabox=_LETTER, text_elements=[], image_elements=[])
+
+
+@pytest.fixture(scope="module")
+def text_report():
+    """A US Letter page with two text elements."""
+    return PageReport(
+        mediabox=_LETTER,
+        text_elements=[TextElement("Hello", 100, 200), TextElement("World", 100, 220)],
+        image_elements=[],
+    )
+
+
+@pytest.fixture(scope="module")
+def image_report():
+    """A US Letter page with a single image."""
+    return PageReport(
+        mediabox=_LETTER,
+        text_elements=[],
+        image_elements=[ImageElement("img1", BoundingBox(50, 60, 150, 160))],
+    )
+
+
+@pytest.fixture(scope="module")
+def large_text_report():
+    """A US Letter page with 100 text elements, enough to overflow a small max_length."""
+    return PageReport(
+        mediabox=_LETTER,
+        text_elements=[TextElement(f"Text{i}", i*10, i*10) for i in range(100)],
+        image_elements=[],
+    )
+
+
+@pytest.fixture(scope="module")
+def mixed_report():
+    """A US Letter page with text on either side of an image."""
+    return PageReport(
+        mediabox=_LETTER,
+        text_elements=[TextElement("Text1", 200, 200), TextElement("Text2", 100, 100)],
+        image_elements=[ImageElement("img1", BoundingBox(150, 150, 250, 250))],
+    )
+
+
 class TestLinearizePdfReport:
     """Test PDF report linearization functionality."""
 
-    def test_empty_report(self):
+    def test_empty_report(self, empty_report):
         """Test linearization of empty report."""
-        report = PageReport(
-            mediabox=BoundingBox(0, 0, 612, 792),
-            text_elements=[],
-            image_elements=[]
-        )
-        
-        result = _linearize_pdf_report(report)
+        result = _linearize_pdf_report(empty_report)
         
         assert "Page dimensions: 612.0x792.0" in result
         assert len(result) < 100  # Should be short
 
-    def test_report_with_text_elements(self):
+    def test_report_with_text_elements(self, text_report):
         """Test linearization with text elements."""
-        text_elements = [
-            TextElement("Hello", 100, 200),
-            TextElement("World", 100, 220),
-        ]
-        report = PageReport(
-            mediabox=BoundingBox(0, 0, 612, 792),
-            text_elements=text_elements,
-            image_elements=[]
-        )
+        result = _linearize_pdf_report(text_report)
         
-        result = _linearize_pdf_report(report)
-        
-        assert "Page dimensions: 612.0x792.0" in result
-        assert "[100x200]Hello" in result
-        assert "[100x220]World" in result
+        _assert_all_in(result, "Page dimensions: 612.0x792.0", "[100x200]Hello", "[100x220]World")
 
-    def test_report_with_image_elements(self):
+    def test_report_with_image_elements(self, image_report):
         """Test linearization with image elements."""
-        image_elements = [
-            ImageElement("img1", BoundingBox(50, 60, 150, 160)),
-        ]
-        report = PageReport(
-            mediabox=BoundingBox(0, 0, 612, 792),
-            text_elements=[],
-            image_elements=image_elements
-        )
-        
-        result = _linearize_pdf_report(report)
+        result = _linearize_pdf_report(image_report)
         
-        assert "Page dimensions: 612.0x792.0" in result
-        assert "[Image 50x60 to 150x160]" in result
+        _assert_all_in(result, "Page dimensions: 612.0x792.0", "[Image 50x60 to 150x160]")
 
-    def test_max_length_truncation(self):
+    def test_max_length_truncation(self, large_text_report):
         """Test truncation when max length is exceeded."""
-        # Create many text elements
-        text_elements = [TextElement(f"Text{i}", i*10, i*10) for i in range(100)]
-        report = PageReport(
-            mediabox=BoundingBox(0, 0, 612, 792),
-            text_elements=text_elements,
-            image_elements=[]
-        )
-        
-        result = _linearize_pdf_report(report, max_length=100)
+        result = _linearize_pdf_report(large_text_report, max_length=100)
         
         assert len(result) <= 100
         assert "Page dimensions" in result
 
-    def test_mixed_elements_sorting(self):
-        """Test proper sorting of mixed text and image elements."""
-        text_elements = [
-            TextElement("Text1", 200, 200),
-            TextElement("Text2", 100, 100),
-        ]
-        image_elements = [
-            ImageElement("img1", BoundingBox(150, 150, 250, 250)),
+    def test_truncation_keeps_edge_elements(self, large_text_report):
+        """Test that the outermost text elements survive truncation."""
+        result = _linearize_pdf_report(large_text_report, max_length=100)
+        
+        _assert_all_in(result, "[0x0]Text0\n", "[990x990]Text99\n")
+
+    def test_truncation_is_deterministic(self, large_text_report):
+        """Test that truncation fills from the top of the page and gives the same text every time."""
+        result = _linearize_pdf_report(large_text_report, max_length=100)
+        
+        assert result == _linearize_pdf_report(large_text_report, max_length=100)
+        assert "[980x980]Text98\n" in result
+
+    def test_truncation_with_rng_samples_page(self, large_text_report):
+        """Test that a caller-supplied generator drives the sample, reproducibly for a given seed."""
+        results = [
+            _linearize_pdf_report(large_text_report, max_length=100, rng=random.Random(seed))
+            for seed in (7, 7)
         ]
+        
+        assert results[0] == results[1]
+        assert len(results[0]) <= 100
+
+    def test_max_length_truncation_large_report(self):
+        """Test that a 10,000-element page is cut to max_length and comes out in position order."""
         report = PageReport(
-            mediabox=BoundingBox(0, 0, 612, 792),
-            text_elements=text_elements,
-            image_elements=image_elements
+            mediabox=_LETTER,
+            text_elements=[TextElement(f"T{i}", i % 600, i // 20) for i in range(10_000)],
+            image_elements=[],
         )
         
         result = _linearize_pdf_report(report)
         
-        # Elements should be sorted by position
-        lines = result.split('\n')
-        # Find the actual order in the result
-        text2_line = next(line for line in lines if "Text2" in line)
-        img_line = next(line for line in lines if "Image" in line)
-        text1_line = next(line for line in lines if "Text1" in line)
+        assert len(result) <= 4000
+        assert result.startswith("Page dimensions: 612.0x792.0\n")
+        positions = [
+            tuple(map(int, line[1:line.index("]")].split("x")))
+            for line in result.splitlines()[1:]
+        ]
+        assert positions == sorted(positions)
+
+    def test_mixed_elements_sorting(self, mixed_report):
+        """Test proper sorting of mixed text and image elements."""
+        result = _linearize_pdf_report(mixed_report)
+        
+        # Find each element's position in the result
+        img_pos, text1_pos, text2_pos = (result.find(s) for s in ("Image", "Text1", "Text2"))
+        assert -1 not in (img_pos, text1_pos, text2_pos)
         
-        # The actual order appears to be: Image, Text1, Text2
-        # Let's verify the sorting is working (elements are sorted by y coordinate descending)
-        assert text2_line in result
-        assert img_line in result
-        assert text1_line in result
+        # The actual order is: Image, Text1, Text2
+        assert img_pos < text1_pos < text2_pos
         
         # Verify the result contains all expected elements
-        assert "Page dimensions: 612.0x792.0" in result
-        assert "[100x100]Text2" in result
-        assert "[Image 150x150 to 250x250]" in result  # Check for correct format
-        assert "[200x200]Text1" in result
+        _assert_all_in(
+            result,
+            "Page dimensions: 612.0x792.0",
+            "[100x100]Text2",
+            "[Image 150x150 to 250x250]",  # Check for correct format
+            "[200x200]Text1",
+        )
 
 
-class TestDataStructures:
-    """Test data structure classes."""
+class TestCleanupElementText:
+    """Test normalisation of extracted text before it is linearized."""
 
-    def test_bounding_box_creation(self):
-        """Test BoundingBox creation and attributes."""
-        bbox = BoundingBox(0, 0, 100, 200)
-        
-        assert bbox.x0 == 0
-        assert bbox.y0 == 0
-        assert bbox.x1 == 100
-        assert bbox.y1 == 200
+    @pytest.mark.parametrize("raw, cleaned", [
+        ("  plain  ", "plain"),
+        ("a[1]", "a\\[1\\]"),
+        ("tab\there\nnext", "tab\\there\\nnext"),
+        ("\u00e2\u20ac\u0153quoted\u00e2\u20ac\u009d", "\"quoted\""),
+    ], ids=["strip", "brackets", "control_chars", "mojibake"])
+    def test_cleanup(self, raw, cleaned):
+        """Test that text is repaired, stripped and escaped."""
+        assert _cleanup_element_text(raw) == cleaned
 
-    def test_bounding_box_from_rectangle(self):
-        """Test BoundingBox.from_rectangle method."""
-        mock_rectangle = [10, 20, 110, 220]
+    def test_repeated_text_is_fixed_once(self, mocker):
+        """Test that text seen before is served from the cache instead of going back through ftfy."""
+        _cleanup_element_text.cache_clear()
+        fix_text = mocker.patch('typhoon_ocr.ocr_utils.ftfy.fix_text', side_effect=lambda text: text)
         
-        bbox = BoundingBox.from_rectangle(mock_rectangle)
-        
-        assert bbox.x0 == 10
-        assert bbox.y0 == 20
-        assert bbox.x1 == 110
-        assert bbox.y1 == 220
+        assert [_cleanup_element_text("Page 1") for _ in range(3)] == ["Page 1"] * 3
+        fix_text.assert_called_once_with("Page 1")
+        _cleanup_element_text.cache_clear()
 
-    def test_text_element_creation(self):
-        """Test TextElement creation."""
-        element = TextElement("Hello World", 100, 200)
+    def test_long_text_is_capped(self):
+        """Test that overly long text keeps its head and tail around an ellipsis."""
+        cleaned = _cleanup_element_text(" ".join(f"word{i}" for i in range(100)))
         
-        assert element.text == "Hello World"
-        assert element.x == 100
-        assert element.y == 200
+        assert len(cleaned) <= 250
+        assert cleaned.startswith("word0 ") and " ... " in cleaned and cleaned.endswith(" word99")
 
-    def test_image_element_creation(self):
-        """Test ImageElement creation."""
-        bbox = BoundingBox(10, 20, 110, 220)
-        element = ImageElement("test_img", bbox)
-        
-        assert element.name == "test_img"
-        assert element.bbox == bbox
 
-    def test_page_report_creation(self):
-        """Test PageReport creation."""
-        bbox = BoundingBox(0, 0, 612, 792)
-        text_elements = [TextElement("Hello", 100, 200)]
-        image_elements = [ImageElement("img", BoundingBox(10, 20, 110, 220))]
-        
-        report = PageReport(bbox, text_elements, image_elements)
-        
-        assert report.mediabox == bbox
-        assert report.text_elements == text_elements
-        assert report.image_elements == image_elements
+class TestMergeImageElements:
+    """Test merging of touching image fragments."""
+
+    def test_chain_of_touching_fragments_merges(self):
+        """Test that fragments linked only through a neighbour still end up in one image."""
+        images = [
+            ImageElement("c", BoundingBox(200, 0, 300, 10)),
+            ImageElement("a", BoundingBox(0, 0, 100, 10)),
+            ImageElement("far", BoundingBox(1000, 1000, 1100, 1010)),
+            ImageElement("b", BoundingBox(100.4, 0, 200, 10)),
+        ]
+
+        merged = _merge_image_elements(images)
+
+        assert merged == [
+            ImageElement("c+a+b", BoundingBox(0, 0, 300, 10)),
+            ImageElement("far", BoundingBox(1000, 1000, 1100, 1010)),
+        ]
+
+    def test_matches_pairwise_overlap(self):
+        """Test that the sweep finds the same groups as checking every pair of boxes."""
+        images = [
+            ImageElement(f"img{i}", BoundingBox(x, y, x + w, y + h))
+            for i, (x, y, w, h) in enumerate(
+                ((i * 37) % 500, (i * 53) % 700, 5 + i % 40, 5 + (i * 7) % 30) for i in range(300)
+            )
+        ]
+
+        def touching(a, b):
+            return (max(a.x0, b.x0) - min(a.x1, b.x1) <= 0.5) and (max(a.y0, b.y0) - min(a.y1, b.y1) <= 0.5)
+
+        # Reference grouping: flood-fill over every pair of boxes
+        expected, seen = [], set()
+        for start in range(len(images)):
+            if start in seen:
+                continue
+            group, stack = set(), [start]
+            while stack:
+                i = stack.pop()
+                if i in group:
+                    continue
+                group.add(i)
+                stack.extend(j for j in range(len(images)) if j not in group and touching(images[i].bbox, images[j].bbox))
+            seen |= group
+            expected.append({images[i].name for i in group})
+
+        merged = _merge_image_elements(images)
+
+        assert sorted(map(sorted, (set(image.name.split("+")) for image in merged))) == sorted(map(sorted, expected))
+
+
+class TestDataStructures:
+    """Test data structure classes."""
+
+    @pytest.mark.parametrize("obj, fields", [
+        (BoundingBox(0, 0, 100, 200), (0, 0, 100, 200)),
+        (BoundingBox.from_rectangle([10, 20, 110, 220]), (10, 20, 110, 220)),
+        (TextElement("Hello World", 100, 200), ("Hello World", 100, 200)),
+        (ImageElement("test_img", BoundingBox(10, 20, 110, 220)), ("test_img", (10, 20, 110, 220))),
+        (
+            PageReport(
+                BoundingBox(0, 0, 612, 792),
+                [TextElement("Hello", 100, 200)],
+                [ImageElement("img", BoundingBox(10, 20, 110, 220))],
+            ),
+            ((0, 0, 612, 792), [("Hello", 100, 200)], [("img", (10, 20, 110, 220))]),
+        ),
+    ], ids=["bounding_box", "bounding_box_from_rectangle", "text_element", "image_element", "page_report"])
+    def test_creation(self, obj, fields):
+        """Test that each data structure keeps its constructor arguments, field by field."""
+        assert dataclasses.astuple(obj) == fields
@@ -11,6 +11,7 @@ import tempfile
 import pytest
 from unittest.mock import patch, MagicMock
 from PIL import Image
+from PIL.JpegImagePlugin import JpegImageFile
 import ftfy
 
 # Import the functions to test
@@ -23,7 +24,11 @@ from typhoon_ocr.ocr_utils import (
     is_base64_string,
     ensure_image_in_path,
     get_prompt,
+    image_to_pdf,
+    prepare_ocr_messages,
+    prepare_ocr_messages_with_image,
 )
+from typhoon_ocr.retry_utils import backoff_delay, retry_after_seconds
 
 
 class TestCapSplitString:
@@ -118,6 +123,14 @@ class TestCleanupElementText:
         assert result == "text with spaces"
 
 
+@pytest.fixture
+def large_jpeg(tmp_path):
+    """A 4000x3000 JPEG on disk, large enough for a 1/4-scale draft decode at 1000px."""
+    path = tmp_path / "large.jpg"
+    Image.new('RGB', (4000, 3000), color='white').save(path, format='JPEG')
+    return path
+
+
 class TestResizeIfNeeded:
     """Test the resize_if_needed function."""
 
@@ -152,6 +165,51 @@ class TestResizeIfNeeded:
         
         assert max(result.size) == 500
 
+    def test_downscale_pre_reduces(self, mocker):
+        """Test that downscaling lets Pillow pre-reduce before the LANCZOS pass."""
+        img = Image.new('RGB', (6000, 4000), color='white')
+        resize = mocker.spy(Image.Image, 'resize')
+        
+        result = resize_if_needed(img, max_size=1000)
+        
+        assert result.size == (1000, 666)
+        assert resize.call_args.kwargs['reducing_gap'] == 3.0
+
+    def test_caller_image_not_drafted(self, large_jpeg):
+        """Test that resizing leaves the caller's undecoded JPEG at its full decode size."""
+        img = Image.open(large_jpeg)
+        
+        result = resize_if_needed(img, max_size=1000)
+        
+        assert result.size == (1000, 750)
+        assert img.size == (4000, 3000)
+
+    def test_prepare_messages_drafts_jpeg_it_opens(self, large_jpeg, mocker):
+        """Test that the v1.5 image path decodes the JPEG it opened at a reduced scale."""
+        draft = mocker.spy(JpegImageFile, 'draft')
+        
+        prepare_ocr_messages(str(large_jpeg), task_type="v1.5", target_image_dim=1000)
+        
+        assert draft.call_args.args[1:] == ("RGB", (1000, 750))
+
+    def test_messages_with_image_match_prepare_messages(self, large_jpeg):
+        """Test that the base64 returned alongside the messages is the image they carry."""
+        messages, image_base64 = prepare_ocr_messages_with_image(str(large_jpeg), task_type="v1.5", target_image_dim=1000)
+        
+        assert messages == prepare_ocr_messages(str(large_jpeg), task_type="v1.5", target_image_dim=1000)
+        assert messages[0]["content"][1]["image_url"]["url"] == f"data:image/png;base64,{image_base64}"
+        assert Image.open(io.BytesIO(base64.b64decode(image_base64))).size == (1000, 750)
+
+    @pytest.mark.parametrize("max_size, drafted", [(None, False), (1000, True)], ids=["full_resolution", "max_size"])
+    def test_image_to_pdf_drafts_only_with_max_size(self, large_jpeg, mocker, max_size, drafted):
+        """Test that image_to_pdf keeps full resolution unless given a max_size."""
+        draft = mocker.spy(JpegImageFile, 'draft')
+        
+        result = image_to_pdf(str(large_jpeg), max_size=max_size)
+        
+        os.unlink(result)
+        assert draft.called is drafted
+
     def test_square_image_resize(self):
         """Test resizing of square images."""
         img = Image.new('RGB', (3000, 3000), color='purple')
@@ -262,6 +320,18 @@ class TestIsBase64String:
         assert is_base64_string("YQ==") is True  # "a"
         assert is_base64_string("YQ") is False  # Missing padding
 
+    def test_path_rejected_without_decoding(self, mocker):
+        """Test that inputs with non-base64 characters up front are rejected before any decode."""
+        b64decode = mocker.patch('typhoon_ocr.ocr_utils.base64.b64decode')
+        
+        assert is_base64_string("C:\\scans\\page.tiff") is False
+        assert is_base64_string("./page.webp") is False
+        b64decode.assert_not_called()
+
+    def test_trailing_newline_still_accepted(self):
+        """Test that base64 read from a file with its trailing newline is still recognised."""
+        assert is_base64_string(base64.b64encode(b"test data").decode() + "\n") is True
+
     def test_unicode_handling(self):
         """Test handling of unicode characters."""
         unicode_bytes = "测试".encode('utf-8')
@@ -288,7 +358,7 @@ class TestEnsureImageInPath:
     @patch('typhoon_ocr.ocr_utils.is_base64_string')
     @patch('typhoon_ocr.ocr_utils.Image')
     @patch('typhoon_ocr.ocr_utils.tempfile')
-    def test_base64_image_processing(self, mock_tempfile, mock_image, mock_is_base64):
+    def test_base64_image_processing(self, mock_tempfile, mock_image, mock_is_base64, fake_b64_image):
         """Test processing of base64 image data."""
         # Setup mocks
         mock_is_base64.return_value = True
@@ -301,11 +371,10 @@ class TestEnsureImageInPath:
         mock_tempfile.NamedTemporaryFile.return_value = mock_temp_file
         
         # Test
-        base64_data = base64.b64encode(b"fake image data").decode()
-        result = ensure_image_in_path(base64_data)
+        result = ensure_image_in_path(fake_b64_image)
         
         # Verify
-        mock_is_base64.assert_called_once_with(base64_data)
+        mock_is_base64.assert_called_once_with(fake_b64_image)
         mock_image.open.assert_called_once()
         mock_img.save.assert_called_once()
         assert result == '/tmp/temp_image.png'
@@ -381,3 +450,37 @@ class TestGetPrompt:
             assert "sample extracted text" in result
             assert "RAW_TEXT_START" in result
             assert "RAW_TEXT_END" in result
+
+    def test_anchor_text_inserted_verbatim(self):
+        """Test that anchor text with braces and brackets lands between the markers unchanged."""
+        anchor = "[10x20]f(x) = {a, b}\n[Image 0x0 to 5x5]"
+        
+        for prompt_name in ["default", "structure"]:
+            result = get_prompt(prompt_name)(anchor)
+            
+            assert result.endswith(f"RAW_TEXT_START\n{anchor}\nRAW_TEXT_END")
+
+
+class TestRetryUtils:
+    """Test retry timing helpers."""
+
+    @pytest.mark.parametrize("attempt, ceiling", [(0, 1.0), (3, 8.0), (10, 60.0)])
+    def test_backoff_delay_full_jitter_with_cap(self, mocker, attempt, ceiling):
+        """Test that the delay is drawn from zero up to the exponential step, never past the cap."""
+        uniform = mocker.patch('typhoon_ocr.retry_utils.random.uniform', return_value=0.5)
+        
+        assert backoff_delay(attempt, base=1.0, cap=60.0) == 0.5
+        uniform.assert_called_once_with(0, ceiling)
+
+    @pytest.mark.parametrize("headers, expected", [
+        ({"retry-after-ms": "1500"}, 1.5),
+        ({"retry-after": "7"}, 7.0),
+        ({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}, 0.0),
+        ({}, None),
+    ], ids=["milliseconds", "seconds", "past_http_date", "missing"])
+    def test_retry_after_seconds(self, headers, expected):
+        """Test reading the server's requested back-off from the error's response headers."""
+        error = Exception()
+        error.response = MagicMock(headers=headers)
+        
+        assert retry_after_seconds(error) == expected
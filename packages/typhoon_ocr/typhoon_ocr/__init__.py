@@ -6,6 +6,7 @@ It focuses on structured text extraction with proper formatting and layout prese
 
 Main Functions:
     - prepare_ocr_messages: Generate OCR-ready messages from PDFs or images
+    - prepare_ocr_messages_with_image: The same messages plus the rendered page as base64
     - get_prompt: Access built-in prompt templates for different OCR tasks (default, structure, v1.5)
     - image_to_pdf: Convert image files to PDF format
     - ocr_document: End-to-end OCR processing with Typhoon API
@@ -30,6 +31,7 @@ Example Usage:
 from .pdf_utils import pdf_utils_available
 from .ocr_utils import (
     prepare_ocr_messages,
+    prepare_ocr_messages_with_image,
     get_prompt,
     get_anchor_text,
     image_to_pdf,
@@ -41,6 +43,7 @@ __version__ = "0.4.1"
 __all__ = [
     "pdf_utils_available",
     "prepare_ocr_messages",
+    "prepare_ocr_messages_with_image",
     "get_prompt",
     "get_anchor_text", 
     "image_to_pdf",
@@ -5,29 +5,44 @@ This code is adapted from https://github.com/allenai/olmocr
 Under the Apache 2.0 license.
 Edited by Typhoon OCR Contributors.
 """
+from array import array
 from dataclasses import dataclass
+from functools import lru_cache
+from operator import attrgetter, itemgetter
+import heapq
 import json
 from openai import OpenAI
 import os
-import re
 import io
 import tempfile
 from PIL import Image
+import string
 import subprocess
+import sys
+import threading
 import base64
-from typing import Any, Callable, Dict, List, Literal
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple
 import random
 import ftfy
 from pypdf.generic import RectangleObject
 from pypdf import PdfReader
 
+try:
+    # SIMD base64 codec; page renders are encoded once per page
+    from pybase64 import b64encode as _b64encode
+except ImportError:
+    from base64 import b64encode as _b64encode
 
-@dataclass(frozen=True)
+# Slotted frozen dataclasses unpickle correctly from 3.11 on; older interpreters keep __dict__
+_SLOTS = {"slots": True} if sys.version_info >= (3, 11) else {}
+
+
+@dataclass(frozen=True, **_SLOTS)
 class Element:
     pass
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, **_SLOTS)
 class BoundingBox:
     x0: float
     y0: float
@@ -39,31 +54,47 @@ class BoundingBox:
         return BoundingBox(rect[0], rect[1], rect[2], rect[3])
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, **_SLOTS)
 class TextElement(Element):
     text: str
     x: float
     y: float
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, **_SLOTS)
 class ImageElement(Element):
     name: str
     bbox: BoundingBox
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, **_SLOTS)
 class PageReport:
     mediabox: BoundingBox
     text_elements: List[TextElement]
     image_elements: List[ImageElement]
     
-def image_to_pdf(image_path):
+class _RealFS:
+    """Filesystem seam for temporary files; tests can swap `_fs` for an in-memory fake."""
+
+    @staticmethod
+    def named_temp_file(*args, **kwargs):
+        # Resolved at call time so patches of `tempfile` still apply
+        return tempfile.NamedTemporaryFile(*args, **kwargs)
+
+
+_fs = _RealFS()
+
+
+def image_to_pdf(image_path, max_size: Optional[int] = None):
     try:
         # Open the image file.
         img = Image.open(image_path)
+        if max_size is not None:
+            # The page will be rendered back at no more than max_size, so a large JPEG
+            # can be decoded at a reduced scale; full resolution is kept otherwise
+            _draft_for_resize(img, max_size)
         # Create a temporary file to store the PDF.
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+        with _fs.named_temp_file(delete=False, suffix=".pdf") as tmp:
             filename = tmp.name
             temp_pdf_created = True
         # Convert image to RGB if necessary and save as PDF.
@@ -92,10 +123,19 @@ def get_pdf_media_box_width_height(local_pdf_path: str, page_num: int) -> tuple[
             "- Windows: Install from https://github.com/oschwartz10612/poppler-windows/releases/ and add to PATH"
         )
         
+    return _per_file_version(_pdfinfo_media_box, local_pdf_path, page_num)
+
+
+@lru_cache(maxsize=1024)
+def _pdfinfo_media_box(local_pdf_path: str, mtime_ns: int, size: int, page_num: int) -> tuple[float, float]:
     # Construct the pdfinfo command to extract info for the specific page
     command = ["pdfinfo", "-f", str(page_num), "-l", str(page_num), "-box", "-enc", "UTF-8", local_pdf_path]
-    # Run the command using subprocess
-    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    # Run the command using subprocess; -enc asks for UTF-8, so decode it as such rather than
+    # with the locale codec, which fails on non-ASCII metadata on Windows
+    result = subprocess.run(
+        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        text=True, encoding="utf-8", errors="replace", timeout=30,
+    )
 
     # Check if there is any error in executing the command
     if result.returncode != 0:
@@ -111,8 +151,51 @@ def get_pdf_media_box_width_height(local_pdf_path: str, page_num: int) -> tuple[
             return abs(media_box[0] - media_box[2]), abs(media_box[3] - media_box[1])
 
     raise ValueError("MediaBox not found in the PDF info.")
+
+
+# pypdf holds the whole file in memory, so only the documents currently being worked on are kept
+@lru_cache(maxsize=4)
+def _pdf_reader(local_pdf_path: str, mtime_ns: int, size: int) -> PdfReader:
+    # Parsed once per file version, so sizing and reporting each page of a document share one parse
+    return PdfReader(local_pdf_path)
+
+
+# PdfReader is not thread-safe, and one cached reader is shared by every caller
+_pdf_reader_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1024)
+def _pypdf_media_box(local_pdf_path: str, mtime_ns: int, size: int, page_num: int) -> tuple[float, float]:
+    if mtime_ns is None:
+        # Uncached call from _per_file_version; there is no file version to key a reader on
+        box = PdfReader(local_pdf_path).pages[page_num - 1].mediabox
+        return float(abs(box.width)), float(abs(box.height))
+    with _pdf_reader_lock:
+        box = _pdf_reader(local_pdf_path, mtime_ns, size).pages[page_num - 1].mediabox
+        return float(abs(box.width)), float(abs(box.height))
+
+
+def _per_file_version(cached, local_pdf_path: str, *args):
+    """Calls an lru_cached `(path, mtime_ns, size, *args)` function for the file's current version."""
+    try:
+        stat = os.stat(local_pdf_path)
+    except OSError:
+        # Nothing to key the cache on; let the uncached call succeed or fail as it would
+        return cached.__wrapped__(local_pdf_path, None, None, *args)
+    return cached(local_pdf_path, stat.st_mtime_ns, stat.st_size, *args)
+
+
+def clear_pdf_cache() -> None:
+    """Drops cached readers, MediaBox sizes and page reports, e.g. after rewriting a PDF within the same mtime tick."""
+    _pdfinfo_media_box.cache_clear()
+    _pypdf_media_box.cache_clear()
+    _pdf_reader.cache_clear()
+    _pdf_report_for_version.cache_clear()
+
     
-def render_pdf_to_base64png(local_pdf_path: str, page_num: int, target_longest_image_dim: int = 2048) -> str:
+def render_pdf_to_base64png(
+    local_pdf_path: str, page_num: int, target_longest_image_dim: int = 2048, image_format: Literal["png", "jpeg"] = "png"
+) -> str:
     from .pdf_utils import pdf_utils_available
     if not pdf_utils_available:
         raise ImportError(
@@ -123,13 +206,23 @@ def render_pdf_to_base64png(local_pdf_path: str, page_num: int, target_longest_i
             "- Windows: Install from https://github.com/oschwartz10612/poppler-windows/releases/ and add to PATH"
         )
         
-    longest_dim = max(get_pdf_media_box_width_height(local_pdf_path, page_num))
+    try:
+        # Reading the MediaBox in-process saves forking pdfinfo for every rendered page
+        width_height = _per_file_version(_pypdf_media_box, local_pdf_path, page_num)
+    except Exception:
+        # pdfinfo copes with files pypdf cannot parse
+        width_height = get_pdf_media_box_width_height(local_pdf_path, page_num)
+    longest_dim = max(width_height)
+
+    # PNG stays the default since OCR wants lossless pages; JPEG output is a fraction of
+    # the size for callers that can accept it
+    format_args = ["-jpeg", "-jpegopt", "quality=90"] if image_format == "jpeg" else ["-png"]
 
-    # Convert PDF page to PNG using pdftoppm
+    # Convert PDF page to an image using pdftoppm
     pdftoppm_result = subprocess.run(
         [
             "pdftoppm",
-            "-png",
+            *format_args,
             "-f",
             str(page_num),
             "-l",
@@ -143,15 +236,28 @@ def render_pdf_to_base64png(local_pdf_path: str, page_num: int, target_longest_i
         stderr=subprocess.PIPE,
     )
     assert pdftoppm_result.returncode == 0, pdftoppm_result.stderr
-    return base64.b64encode(pdftoppm_result.stdout).decode("utf-8")
+    return _b64encode(pdftoppm_result.stdout).decode("ascii")
+
 
+# Sort keys for picking a page's edge elements in _linearize_pdf_report
+_BBOX_X0, _BBOX_X1 = attrgetter("bbox.x0"), attrgetter("bbox.x1")
+_BBOX_Y0, _BBOX_Y1 = attrgetter("bbox.y0"), attrgetter("bbox.y1")
+_X, _Y = attrgetter("x"), attrgetter("y")
+# The string and its precomputed length stored with each linearized entry
+_STRING, _LENGTH = itemgetter(2), itemgetter(4)
 
-def _linearize_pdf_report(report: PageReport, max_length: int = 4000) -> str:
-    result = ""
-    result += f"Page dimensions: {report.mediabox.x1:.1f}x{report.mediabox.y1:.1f}\n"
+
+def _reading_order_key(element: tuple) -> tuple[float, float]:
+    """Orders (type, element, string, position, length) entries top of the page first, then left to right."""
+    x, y = element[3]
+    return -y, x
+
+
+def _linearize_pdf_report(report: PageReport, max_length: int = 4000, rng: Optional[random.Random] = None) -> str:
+    header = f"Page dimensions: {report.mediabox.x1:.1f}x{report.mediabox.y1:.1f}\n"
 
     if max_length < 20:
-        return result
+        return header
 
     images = _merge_image_elements(report.image_elements)
 
@@ -172,82 +278,84 @@ def _linearize_pdf_report(report: PageReport, max_length: int = 4000) -> str:
         text_str = f"[{element.x:.0f}x{element.y:.0f}]{element_text}\n"  # type: ignore
         text_strings.append((element, text_str))
 
-    # Combine all elements with their positions for sorting
-    all_elements: list[tuple[str, ImageElement, str, tuple[float, float]]] = []
+    # Combine all elements with their positions for sorting, and each string's length
+    # so it is measured once
+    all_elements: list[tuple[str, ImageElement, str, tuple[float, float], int]] = []
     for elem, s in image_strings:
         position = (elem.bbox.x0, elem.bbox.y0)
-        all_elements.append(("image", elem, s, position))
+        all_elements.append(("image", elem, s, position, len(s)))
     for elem, s in text_strings:
         position = (elem.x, elem.y)  # type: ignore
-        all_elements.append(("text", elem, s, position))
+        all_elements.append(("text", elem, s, position, len(s)))
 
     # Calculate total length
-    total_length = len(result) + sum(len(s) for _, _, s, _ in all_elements)
+    total_length = len(header) + sum(map(_LENGTH, all_elements))
 
     if total_length <= max_length:
-        # Include all elements
-        for _, _, s, _ in all_elements:
-            result += s
-        return result
+        # Include all elements; one join keeps concatenation linear in the page size
+        return header + "".join(map(_STRING, all_elements))
 
     # Identify elements with min/max coordinates
     edge_elements = set()
 
+    # attrgetter keys run in C, so each min/max pass makes no Python-level calls
     if images:
-        min_x0_image = min(images, key=lambda e: e.bbox.x0)
-        max_x1_image = max(images, key=lambda e: e.bbox.x1)
-        min_y0_image = min(images, key=lambda e: e.bbox.y0)
-        max_y1_image = max(images, key=lambda e: e.bbox.y1)
+        min_x0_image = min(images, key=_BBOX_X0)
+        max_x1_image = max(images, key=_BBOX_X1)
+        min_y0_image = min(images, key=_BBOX_Y0)
+        max_y1_image = max(images, key=_BBOX_Y1)
         edge_elements.update([min_x0_image, max_x1_image, min_y0_image, max_y1_image])
 
-    if report.text_elements:
-        text_elements = [e for e in report.text_elements if len(e.text.strip()) > 0]
-        if text_elements:
-            min_x_text = min(text_elements, key=lambda e: e.x)
-            max_x_text = max(text_elements, key=lambda e: e.x)
-            min_y_text = min(text_elements, key=lambda e: e.y)
-            max_y_text = max(text_elements, key=lambda e: e.y)
-            edge_elements.update([min_x_text, max_x_text, min_y_text, max_y_text])  # type: ignore
+    if text_strings:
+        # text_strings already holds exactly the non-blank text elements
+        text_elements = [e for e, _ in text_strings]
+        min_x_text = min(text_elements, key=_X)
+        max_x_text = max(text_elements, key=_X)
+        min_y_text = min(text_elements, key=_Y)
+        max_y_text = max(text_elements, key=_Y)
+        edge_elements.update([min_x_text, max_x_text, min_y_text, max_y_text])  # type: ignore
 
     # Keep track of element IDs to prevent duplication
     selected_element_ids = set()
     selected_elements = []
 
     # Include edge elements first
-    for elem_type, elem, s, position in all_elements:
+    for entry in all_elements:
+        elem = entry[1]
         if elem in edge_elements and id(elem) not in selected_element_ids:
-            selected_elements.append((elem_type, elem, s, position))
+            selected_elements.append(entry)
             selected_element_ids.add(id(elem))
 
     # Calculate remaining length
-    current_length = len(result) + sum(len(s) for _, _, s, _ in selected_elements)
+    current_length = len(header) + sum(map(_LENGTH, selected_elements))
     _remaining_length = max_length - current_length
 
     # Exclude edge elements from the pool
-    remaining_elements = [(elem_type, elem, s, position) for elem_type, elem, s, position in all_elements if id(elem) not in selected_element_ids]
+    remaining_elements = [entry for entry in all_elements if id(entry[1]) not in selected_element_ids]
 
-    # Sort remaining elements by their positions (e.g., x-coordinate and then y-coordinate)
-    # remaining_elements.sort(key=lambda x: (x[3][0], x[3][1]))
-
-    # Shuffle remaining elements randomly
-    random.shuffle(remaining_elements)
+    if rng is None:
+        # Fill in reading order, top of the page (largest PDF y) first, so the same page
+        # always yields the same anchor text
+        remaining_elements.sort(key=_reading_order_key)
+    else:
+        # Callers wanting a varied sample of the page pass their own generator
+        rng.shuffle(remaining_elements)
 
     # Add elements until reaching max_length
-    for elem_type, elem, s, position in remaining_elements:
-        if current_length + len(s) > max_length:
+    for entry in remaining_elements:
+        length = entry[4]
+        if current_length + length > max_length:
             break
-        selected_elements.append((elem_type, elem, s, position))
-        selected_element_ids.add(id(elem))
-        current_length += len(s)
+        selected_elements.append(entry)
+        selected_element_ids.add(id(entry[1]))
+        current_length += length
 
-    # Sort selected elements by their positions to maintain logical order
-    selected_elements.sort(key=lambda x: (x[3][0], x[3][1]))
+    # Sort selected elements by their positions to maintain logical order; the stored
+    # (x, y) tuple is the key itself, so no per-element key tuple is built
+    selected_elements.sort(key=itemgetter(3))
 
     # Build the final result
-    for _, _, s, _ in selected_elements:
-        result += s
-
-    return result
+    return header + "".join(map(_STRING, selected_elements))
 
 
 def _cap_split_string(text: str, max_length: int) -> str:
@@ -263,32 +371,31 @@ def _cap_split_string(text: str, max_length: int) -> str:
     return f"{head} ... {tail}"
 
 
-def _cleanup_element_text(element_text: str) -> str:
-    MAX_TEXT_ELEMENT_LENGTH = 250
-    TEXT_REPLACEMENTS = {"[": "\\[", "]": "\\]", "\n": "\\n", "\r": "\\r", "\t": "\\t"}
-    text_replacement_pattern = re.compile("|".join(re.escape(key) for key in TEXT_REPLACEMENTS.keys()))
+_MAX_TEXT_ELEMENT_LENGTH = 250
+# Every replacement maps one character, so str.translate does the whole job in C
+_TEXT_REPLACEMENTS = str.maketrans({"[": "\\[", "]": "\\]", "\n": "\\n", "\r": "\\r", "\t": "\\t"})
+
 
+# Headers, footers and page numbers repeat across pages, and ftfy is the expensive step
+@lru_cache(maxsize=4096)
+def _cleanup_element_text(element_text: str) -> str:
     element_text = ftfy.fix_text(element_text).strip()
 
     # Replace square brackets with escaped brackets and other escaped chars
-    element_text = text_replacement_pattern.sub(lambda match: TEXT_REPLACEMENTS[match.group(0)], element_text)
+    element_text = element_text.translate(_TEXT_REPLACEMENTS)
 
-    return _cap_split_string(element_text, MAX_TEXT_ELEMENT_LENGTH)
+    return _cap_split_string(element_text, _MAX_TEXT_ELEMENT_LENGTH)
 
 def _merge_image_elements(images: List[ImageElement], tolerance: float = 0.5) -> List[ImageElement]:
     n = len(images)
-    parent = list(range(n))  # Initialize Union-Find parent pointers
+    parent = array("i", range(n))  # Initialize Union-Find parent pointers, packed as C ints
 
     def find(i):
-        # Find with path compression
-        root = i
-        while parent[root] != root:
-            root = parent[root]
+        # Find with path halving: one pass, pointing each visited node at its grandparent
         while parent[i] != i:
-            parent_i = parent[i]
-            parent[i] = root
-            i = parent_i
-        return root
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
 
     def union(i, j):
         # Union by attaching root of one tree to another
@@ -297,18 +404,28 @@ def _merge_image_elements(images: List[ImageElement], tolerance: float = 0.5) ->
         if root_i != root_j:
             parent[root_i] = root_j
 
-    def bboxes_overlap(b1: BoundingBox, b2: BoundingBox, tolerance: float) -> bool:
-        # Compute horizontal and vertical distances between boxes
-        h_dist = max(0, max(b1.x0, b2.x0) - min(b1.x1, b2.x1))
-        v_dist = max(0, max(b1.y0, b2.y0) - min(b1.y1, b2.y1))
+    def bboxes_overlap(b1: tuple, b2: tuple, tolerance: float) -> bool:
+        # Compute horizontal and vertical distances between (x0, y0, x1, y1) boxes
+        h_dist = max(0, max(b1[0], b2[0]) - min(b1[2], b2[2]))
+        v_dist = max(0, max(b1[1], b2[1]) - min(b1[3], b2[3]))
         # Check if distances are within tolerance
         return h_dist <= tolerance and v_dist <= tolerance
 
-    # Union overlapping images
-    for i in range(n):
-        for j in range(i + 1, n):
-            if bboxes_overlap(images[i].bbox, images[j].bbox, tolerance):
+    # Coordinates staged once as plain tuples, so the sweep below indexes them
+    # instead of going through two attribute lookups per coordinate
+    boxes = [(e.bbox.x0, e.bbox.y0, e.bbox.x1, e.bbox.y1) for e in images]
+
+    # Union overlapping images with a sweep over x0: a box whose x1 falls more than
+    # `tolerance` short of the current x0 can never touch this or any later box
+    active: list[tuple[float, int]] = []  # min-heap of (x1, index)
+    for j in sorted(range(n), key=boxes.__getitem__):
+        box_j = boxes[j]
+        while active and active[0][0] < box_j[0] - tolerance:
+            heapq.heappop(active)
+        for _, i in active:
+            if bboxes_overlap(boxes[i], box_j, tolerance):
                 union(i, j)
+        heapq.heappush(active, (box_j[2], j))
 
     # Group images by their root parent
     groups: dict[int, list[int]] = {}
@@ -345,39 +462,37 @@ def _transform_point(x, y, m):
     y_new = m[1] * x + m[3] * y + m[5]
     return x_new, y_new
 
-def _mult(m: List[float], n: List[float]) -> List[float]:
-    return [
-        m[0] * n[0] + m[1] * n[2],
-        m[0] * n[1] + m[1] * n[3],
-        m[2] * n[0] + m[3] * n[2],
-        m[2] * n[1] + m[3] * n[3],
-        m[4] * n[0] + m[5] * n[2] + n[4],
-        m[4] * n[1] + m[5] * n[3] + n[5],
-    ]
+def _mult_origin(m: List[float], n: List[float]) -> tuple[float, float]:
+    # Translation part (e, f) of the product m * n, i.e. where m's origin lands under n;
+    # the text visitor only needs these two of the product's six entries
+    return m[4] * n[0] + m[5] * n[2] + n[4], m[4] * n[1] + m[5] * n[3] + n[5]
     
-def _pdf_report(local_pdf_path: str, page_num: int) -> PageReport:
-    reader = PdfReader(local_pdf_path)
+def _pdf_report(local_pdf_path: str, page_num: int, reader: Optional[PdfReader] = None) -> PageReport:
+    if reader is None:
+        reader = PdfReader(local_pdf_path)
     page = reader.pages[page_num - 1]
     resources = page.get("/Resources", {})
     xobjects = resources.get("/XObject", {})
     text_elements, image_elements = [], []
+    # Bound once; the visitors run for every glyph and drawing operator on the page
+    add_text, add_image, get_xobject = text_elements.append, image_elements.append, xobjects.get
 
     def visitor_body(text, cm, tm, font_dict, font_size):
-        txt2user = _mult(tm, cm)
-        text_elements.append(TextElement(text, txt2user[4], txt2user[5]))
+        x, y = _mult_origin(tm, cm)
+        add_text(TextElement(text, x, y))
 
     def visitor_op(op, args, cm, tm):
         if op == b"Do":
             xobject_name = args[0]
-            xobject = xobjects.get(xobject_name)
+            xobject = get_xobject(xobject_name)
             if xobject and xobject["/Subtype"] == "/Image":
                 # Compute image bbox
                 # The image is placed according to the CTM
                 _width = xobject.get("/Width")
                 _height = xobject.get("/Height")
-                x0, y0 = _transform_point(0, 0, cm)
+                x0, y0 = cm[4], cm[5]  # _transform_point(0, 0, cm)
                 x1, y1 = _transform_point(1, 1, cm)
-                image_elements.append(ImageElement(xobject_name, BoundingBox(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))))
+                add_image(ImageElement(xobject_name, BoundingBox(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))))
 
     page.extract_text(visitor_text=visitor_body, visitor_operand_before=visitor_op)
 
@@ -387,6 +502,16 @@ def _pdf_report(local_pdf_path: str, page_num: int) -> PageReport:
         image_elements=image_elements,
     )
     
+# Retries and repeated prompts ask for the same page again; re-parsing it is wasted work
+@lru_cache(maxsize=128)
+def _pdf_report_for_version(local_pdf_path: str, mtime_ns: int, size: int, page_num: int) -> PageReport:
+    if mtime_ns is None:
+        # Uncached call from _per_file_version; there is no file version to key a reader on
+        return _pdf_report(local_pdf_path, page_num)
+    with _pdf_reader_lock:
+        return _pdf_report(local_pdf_path, page_num, _pdf_reader(local_pdf_path, mtime_ns, size))
+
+
 def get_anchor_text(
     local_pdf_path: str, page: int, pdf_engine: Literal["pdftotext", "pdfium", "pypdf", "topcoherency", "pdfreport"], target_length: int = 4000
 ) -> str:
@@ -394,25 +519,32 @@ def get_anchor_text(
 
     
     if pdf_engine == "pdfreport":
-        return _linearize_pdf_report(_pdf_report(local_pdf_path, page), max_length=target_length)
+        report = _per_file_version(_pdf_report_for_version, local_pdf_path, page)
+        return _linearize_pdf_report(report, max_length=target_length)
     else:
         raise NotImplementedError("Unknown engine")
 
-PROMPTS_SYS = {
-    "default": lambda base_text: (f"Below is an image of a document page along with its dimensions. "
-        f"Simply return the markdown representation of this document, presenting tables in markdown format as they naturally appear.\n"
-        f"If the document contains images, use a placeholder like dummy.png for each image.\n"
-        f"Your final output must be in JSON format with a single key `natural_text` containing the response.\n"
-        f"RAW_TEXT_START\n{base_text}\nRAW_TEXT_END"),
-    "structure": lambda base_text: (
-        f"Below is an image of a document page, along with its dimensions and possibly some raw textual content previously extracted from it. "
-        f"Note that the text extraction may be incomplete or partially missing. Carefully consider both the layout and any available text to reconstruct the document accurately.\n"
-        f"Your task is to return the markdown representation of this document, presenting tables in HTML format as they naturally appear.\n"
-        f"If the document contains images or figures, analyze them and include the tag <figure>IMAGE_ANALYSIS</figure> in the appropriate location.\n"
-        f"Your final output must be in JSON format with a single key `natural_text` containing the response.\n"
-        f"RAW_TEXT_START\n{base_text}\nRAW_TEXT_END"
-    ),
-    "v1.5": lambda base_text=None, figure_language="Thai": f"""Extract all text from the image.
+# Prompt templates are assembled once; each call fills its placeholder with str.replace,
+# which runs in C, instead of re-formatting the whole prompt through an f-string
+_BASE_TEXT = "\x00BASE_TEXT\x00"
+_FIGURE_LANGUAGE = "\x00FIGURE_LANGUAGE\x00"
+
+_DEFAULT_TEMPLATE = ("Below is an image of a document page along with its dimensions. "
+    "Simply return the markdown representation of this document, presenting tables in markdown format as they naturally appear.\n"
+    "If the document contains images, use a placeholder like dummy.png for each image.\n"
+    "Your final output must be in JSON format with a single key `natural_text` containing the response.\n"
+    f"RAW_TEXT_START\n{_BASE_TEXT}\nRAW_TEXT_END")
+
+_STRUCTURE_TEMPLATE = (
+    "Below is an image of a document page, along with its dimensions and possibly some raw textual content previously extracted from it. "
+    "Note that the text extraction may be incomplete or partially missing. Carefully consider both the layout and any available text to reconstruct the document accurately.\n"
+    "Your task is to return the markdown representation of this document, presenting tables in HTML format as they naturally appear.\n"
+    "If the document contains images or figures, analyze them and include the tag <figure>IMAGE_ANALYSIS</figure> in the appropriate location.\n"
+    "Your final output must be in JSON format with a single key `natural_text` containing the response.\n"
+    f"RAW_TEXT_START\n{_BASE_TEXT}\nRAW_TEXT_END"
+)
+
+_V15_TEMPLATE = f"""Extract all text from the image.
 
 
 Instructions:
@@ -428,15 +560,39 @@ Formatting Rules:
 
 
 <figure>
-Describe the image's main elements (people, objects, text), note any contextual clues (place, event, culture), mention visible text and its meaning, provide deeper analysis when relevant (especially for financial charts, graphs, or documents), comment on style or architecture if relevant, then give a concise overall summary. Describe in {figure_language}.
+Describe the image's main elements (people, objects, text), note any contextual clues (place, event, culture), mention visible text and its meaning, provide deeper analysis when relevant (especially for financial charts, graphs, or documents), comment on style or architecture if relevant, then give a concise overall summary. Describe in {_FIGURE_LANGUAGE}.
 </figure>
 
 
 - Page Numbers: Wrap page numbers in <page_number>...</page_number> (e.g., <page_number>14</page_number>).
 - Checkboxes: Use ☐ for unchecked and ☑ for checked boxes.
-    """,
+    """
+
+
+def _default_prompt(base_text: str) -> str:
+    return _DEFAULT_TEMPLATE.replace(_BASE_TEXT, str(base_text))
+
+
+def _structure_prompt(base_text: str) -> str:
+    return _STRUCTURE_TEMPLATE.replace(_BASE_TEXT, str(base_text))
+
+
+def _v15_prompt(base_text: Optional[str] = None, figure_language: str = "Thai") -> str:
+    # v1.5 does not use anchor text; base_text is accepted for a uniform call signature
+    return _V15_TEMPLATE.replace(_FIGURE_LANGUAGE, str(figure_language))
+
+
+def _invalid_prompt(base_text: str) -> str:
+    return "Invalid PROMPT_NAME provided."
+
+
+PROMPTS_SYS = {
+    "default": _default_prompt,
+    "structure": _structure_prompt,
+    "v1.5": _v15_prompt,
 }
 
+
 def get_prompt(prompt_name: str) -> Callable[[str], str]:
     """
     Get a prompt template function for the specified prompt type.
@@ -462,7 +618,11 @@ def get_prompt(prompt_name: str) -> Callable[[str], str]:
         >>> print(formatted_prompt[:50])  # Print first 50 chars
         Below is an image of a document page along with its
     """
-    return PROMPTS_SYS.get(prompt_name, lambda x: "Invalid PROMPT_NAME provided.")
+    return PROMPTS_SYS.get(prompt_name, _invalid_prompt)
+
+# Pillow documents 3.0 as indistinguishable from a full LANCZOS resize
+_RESIZE_REDUCING_GAP = 3.0
+
 
 def resize_if_needed(img: Image.Image, max_size: int = 2048) -> Image.Image:
     """
@@ -476,28 +636,47 @@ def resize_if_needed(img: Image.Image, max_size: int = 2048) -> Image.Image:
     Returns:
         Resized image or original if no resize needed
     """
-    width, height = img.size
+    new_size = _resize_target(img.size, max_size)
+    if new_size is not None:
+        # reducing_gap lets Pillow shrink by whole factors with a cheap box filter before the
+        # LANCZOS pass, which then works on a far smaller image when downscaling large scans
+        img = img.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=_RESIZE_REDUCING_GAP)
+        return img
+    else:
+        return img  # no resize
+
+
+def _resize_target(size: tuple[int, int], max_size: int) -> Optional[tuple[int, int]]:
+    """The size resize_if_needed scales an image of `size` to, or None when it leaves it alone."""
+    width, height = size
     # Only resize if one dimension exceeds 300
     if width > 300 or height > 300:
         if width >= height:
             # scale width to max_size
             scale = max_size / float(width)
-            new_size = (max_size, int(height * scale))
+            return (max_size, int(height * scale))
         else:
             # scale height to max_size
             scale = max_size / float(height)
-            new_size = (int(width * scale), max_size)
+            return (int(width * scale), max_size)
+    return None
 
-        img = img.resize(new_size, Image.Resampling.LANCZOS)
-        return img
-    else:
-        return img  # no resize
+
+def _draft_for_resize(img: Image.Image, max_size: int) -> None:
+    """
+    Lets an image the library has just opened decode at 1/2, 1/4 or 1/8 scale when it
+    is about to be downscaled, never below the resize target. Only JPEGs that have not
+    been loaded yet are affected; only call this on images opened by the caller itself.
+    """
+    new_size = _resize_target(img.size, max_size)
+    if new_size is not None and new_size[0] < img.size[0]:
+        img.draft("RGB", new_size)
 
 def image_to_base64png(img: Image.Image):
     buffered = io.BytesIO()
     img = img.convert("RGB")
     img.save(buffered, format="JPEG")
-    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+    return _b64encode(buffered.getvalue()).decode("ascii")
 
 def get_anchor_text_from_image(img: Image.Image):
     width = float(img.width)
@@ -558,6 +737,32 @@ def prepare_ocr_messages(
         >>> # Process an image file (always page 1)
         >>> messages = prepare_ocr_messages("scan.jpg")
     """
+    messages, _ = prepare_ocr_messages_with_image(
+        pdf_or_image_path,
+        task_type=task_type,
+        target_image_dim=target_image_dim,
+        target_text_length=target_text_length,
+        page_num=page_num,
+        figure_language=figure_language,
+    )
+    return messages
+
+
+def prepare_ocr_messages_with_image(
+    pdf_or_image_path: str,
+    task_type: str = "v1.5",
+    target_image_dim: int = 1800,
+    target_text_length: int = 8000,
+    page_num: int = 1,
+    figure_language: str = "Thai",
+) -> Tuple[List[Dict[str, Any]], str]:
+    """
+    Same as `prepare_ocr_messages`, but also returns the page render as raw base64,
+    for callers that show or store the image without decoding the data URI again.
+
+    Returns:
+        Tuple[List[Dict[str, Any]], str]: The messages and the base64 page image
+    """
     # Check for required PDF utilities
     ext = os.path.splitext(pdf_or_image_path)[1].lower()
     is_image = ext not in [".pdf"]
@@ -571,6 +776,8 @@ def prepare_ocr_messages(
             img = Image.open(pdf_or_image_path)
             # For v1.5, use different resize logic
             if task_type == "v1.5":
+                # Opened here, so a large JPEG can be decoded straight at a reduced scale
+                _draft_for_resize(img, target_image_dim)
                 img = resize_if_needed(img, max_size=target_image_dim)
             # Render the image to base64 PNG
             image_base64 = image_to_base64png(img)
@@ -618,16 +825,24 @@ def prepare_ocr_messages(
             }
         ]
         
-        return messages
+        return messages, image_base64
     except IndexError:
         raise ValueError(f"Page number {page_num} is out of range for the document {pdf_or_image_path}")
     except Exception as e:
         raise ValueError(f"Error processing document: {str(e)}")
 
+# Characters a base64 re-encoding can start with; anything else in the first 10 fails the check
+_BASE64_CHARS = frozenset(string.ascii_letters + string.digits + "+/=")
+
+
 def is_base64_string(input_string: str) -> bool:
+    # Cheap reject for file paths and plain text, before decoding the whole string
+    if not _BASE64_CHARS.issuperset(input_string[:10]):
+        return False
     try:
-        # Try to decode and re-encode to check validity
-        return base64.b64encode(base64.b64decode(input_string))[:10] == input_string.encode()[:10]
+        # Try to decode and re-encode to check validity; the first 9 decoded bytes
+        # re-encode to the first 12 characters, which covers the 10 compared
+        return base64.b64encode(base64.b64decode(input_string)[:9])[:10] == input_string.encode()[:10]
     except Exception:
         return False
 
@@ -650,7 +865,7 @@ def ensure_image_in_path(input_string: str) -> str:
             image = Image.open(io.BytesIO(image_data))
             image_format = image.format.lower()  # e.g. 'jpeg', 'png'
             # Save image to a temporary file with correct extension
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=f".{image_format}")
+            temp_file = _fs.named_temp_file(delete=False, suffix=f".{image_format}")
             image.save(temp_file.name, format=image_format)
             return temp_file.name
         except Exception:
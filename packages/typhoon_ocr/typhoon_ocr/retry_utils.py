@@ -0,0 +1,44 @@
+"""
+Retry timing helpers for clients of the Typhoon OCR API.
+"""
+import random
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """
+    Full-jitter exponential backoff: a uniform delay between 0 and `base * 2 ** attempt`,
+    capped at `cap`, so concurrent requests failing together do not retry in lock-step.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """
+    Reads the server's requested back-off from a failed API response, if any.
+    Supports `retry-after-ms`, and `retry-after` as seconds or an HTTP date.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(retry_at.tzinfo)).total_seconds())
@@ -0,0 +1,66 @@
+// Copy-to-clipboard bridge for the Gradio app; loaded once via APP_HEAD and cached by the browser
+window.typhoonCopy = (text) => {
+    if (!text) return;
+    
+    const showToast = (message) => {
+        let container = document.getElementById('toast-container');
+        if (!container) {
+            container = document.createElement('div');
+            container.id = 'toast-container';
+            document.body.appendChild(container);
+        }
+        
+        const toast = document.createElement('div');
+        toast.textContent = message;
+        toast.style.background = 'rgba(16, 185, 129, 0.9)';
+        toast.style.backdropFilter = 'blur(8px)';
+        toast.style.color = '#fff';
+        toast.style.padding = '14px 24px';
+        toast.style.marginTop = '10px';
+        toast.style.borderRadius = '12px';
+        toast.style.boxShadow = '0 10px 15px -3px rgba(0, 0, 0, 0.3)';
+        toast.style.fontWeight = '500';
+        toast.style.fontSize = '0.95rem';
+        toast.style.display = 'flex';
+        toast.style.alignItems = 'center';
+        toast.style.gap = '8px';
+        toast.style.fontFamily = "'Kanit', sans-serif";
+        toast.style.animation = 'slideIn 0.3s cubic-bezier(0.16, 1, 0.3, 1)';
+        
+        container.appendChild(toast);
+        
+        setTimeout(() => {
+            toast.style.opacity = '0';
+            toast.style.transform = 'translateY(10px)';
+            toast.style.transition = 'all 0.5s ease';
+            setTimeout(() => toast.remove(), 500);
+        }, 3000);
+    }
+    
+    // Inject Styles for Toast Animation
+    const style = document.createElement('style');
+    style.innerHTML = `
+        @keyframes slideIn {
+            from { opacity: 0; transform: translateY(20px); }
+            to { opacity: 1; transform: translateY(0); }
+        }
+    `;
+    document.head.appendChild(style);
+
+    // Copy to Clipboard with Fallback
+    navigator.clipboard.writeText(text).then(() => {
+        showToast("✨ คัดลอกข้อความสำเร็จ!");
+    }).catch(err => {
+        const ta = document.createElement('textarea');
+        ta.value = text;
+        document.body.appendChild(ta);
+        ta.select();
+        try {
+            document.execCommand('copy');
+            showToast("✨ คัดลอกข้อความสำเร็จ!");
+        } catch (e) {
+            alert("Failed to copy");
+        }
+        document.body.removeChild(ta);
+    });
+};